@@ -3,17 +3,33 @@
 #----------------------------------------------------------------------------#
 
 import json
-import dateutil.parser
-import babel
+import base64
+import hmac
+import click
+from bisect import bisect_left, bisect_right
 from datetime import *
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
+from decimal import Decimal
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort, jsonify, stream_with_context
 from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.dialects.postgresql import array
 import logging
 from logging import Formatter, FileHandler
 from flask_wtf import Form
 from forms import *
-from models import Venue, Artist, Show, setup_db
+from models import Venue, Artist, Show, ShowCount, BookingConflict, DEFAULT_SHOW_DURATION, setup_db, show_series, \
+  load_booking_index, roll_over_show_counts, rebuild_show_counts
+from autocomplete import name_index
+from matchmaking import match_index
+from cache import page_cache, conditional
+from formatting import format_datetime, format_show_times
+from feeds import ics_feed, csv_feed
+from importer import import_command
+from instrumentation import query_recorder
+from readmodel import read_model
+from assets import assets, build_assets_command
+from templating import init_templates, precompile_templates_command
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
@@ -22,20 +38,252 @@ app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object('config')
 db = setup_db(app)
+page_cache.init_app(app)
+if app.config['QUERY_INSTRUMENTATION']:
+    query_recorder.init_app(app, db)
+app.cli.add_command(import_command)
+app.cli.add_command(build_assets_command)
+assets.init_app(app)
+app.cli.add_command(precompile_templates_command)
+if app.config['READ_MODEL_ENABLED']:
+    read_model.init_app(app, db)
+
+# the in-memory indexes are only kept current by this process's writes from
+# here on, so they start from the primary, never from a lagging replica
+@app.before_first_request
+def load_name_index():
+  name_index.load('venues', db.session.execute(db.select([Venue.id, Venue.name]), bind=db.engine))
+  name_index.load('artists', db.session.execute(db.select([Artist.id, Artist.name]), bind=db.engine))
+
+@app.before_first_request
+def load_match_index():
+  match_index.load('venue', db.session.execute(
+      db.select([Venue.id, Venue.name, Venue.state, Venue.city, Venue.genres])
+        .where(Venue.seeking_talent.is_(True)), bind=db.engine))
+  match_index.load('artist', db.session.execute(
+      db.select([Artist.id, Artist.name, Artist.state, Artist.city, Artist.genres])
+        .where(Artist.seeking_venue.is_(True)), bind=db.engine))
+
+@app.before_first_request
+def load_read_model():
+  if app.config['READ_MODEL_ENABLED']:
+      read_model.load()
+
+@app.before_first_request
+def load_bookings():
+  # Postgres checks double bookings itself, see models.booking_conflict
+  if db.engine.dialect.name != 'postgresql':
+      load_booking_index()
 
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format, None, 'en_US')
-
 app.jinja_env.filters['datetime'] = format_datetime
+# after every filter and global is registered, since compiling checks them
+init_templates(app)
+
+#----------------------------------------------------------------------------#
+# Helpers.
+#----------------------------------------------------------------------------#
+
+def split_shows(shows, serializer):
+  # partitions an already loaded list of shows in a single pass so detail
+  # pages need one Show query regardless of how many shows there are
+  current_time = datetime.now()
+  past_shows = []
+  upcoming_shows = []
+  for show in shows:
+      if show.start_time > current_time:
+          upcoming_shows.append(serializer(show))
+      else:
+          past_shows.append(serializer(show))
+  return past_shows, upcoming_shows
+
+def encode_cursor(*values):
+  # opaque keyset cursor: the sort key of the first or last row on a page
+  raw = json.dumps([value.isoformat() if isinstance(value, datetime) else str(value) for value in values])
+  return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+  try:
+      return json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+  except (ValueError, TypeError):
+      abort(400)
+
+def page_size(default_key):
+  limit = request.args.get('limit', app.config[default_key], type=int)
+  return max(1, min(limit, app.config['MAX_PAGE_SIZE']))
+
+def read_cursor(parsers, default_size_key):
+  # (page size, raw cursor, paging forward, parsed cursor values) from
+  # ?limit=, ?after= and ?before=
+  limit = page_size(default_size_key)
+  before = request.args.get('before')
+  cursor = before or request.args.get('after')
+  values = None
+  if cursor:
+      values = decode_cursor(cursor)
+      try:
+          if len(values) != len(parsers):
+              raise ValueError(cursor)
+          values = [parse(value) for parse, value in zip(parsers, values)]
+      # Decimal raises an ArithmeticError on a malformed value
+      except (TypeError, ValueError, ArithmeticError):
+          abort(400)
+  return limit, cursor, not before, values
+
+def page_links(rows, key_of, limit, cursor, forward, has_more, link_args):
+  return {
+      "limit": limit,
+      "args": link_args,
+      "next": key_of(rows[-1]) if rows and (has_more if forward else True) else None,
+      "prev": key_of(rows[0]) if rows and (cursor if forward else has_more) else None
+  }
+
+def keyset_page(query, keys, default_size_key, **link_args):
+  # keys is a list of (row attribute, sort expression, cursor parser,
+  # descending) making up a unique sort key. ?after= pages forward from a
+  # row and ?before= pages back to it; each page is one indexed range scan,
+  # and one extra row tells whether there is another page without a COUNT.
+  limit, cursor, forward, values = read_cursor([parse for name, expression, parse, descending in keys],
+                                               default_size_key)
+  if cursor:
+      # (a, b) > (x, y) spelled out as a > x OR (a = x AND b > y) for every backend
+      clauses = []
+      for position, (name, expression, parse, descending) in enumerate(keys):
+          equal = [keys[earlier][1] == values[earlier] for earlier in range(position)]
+          if descending == forward:
+              clauses.append(db.and_(*(equal + [expression < values[position]])))
+          else:
+              clauses.append(db.and_(*(equal + [expression > values[position]])))
+      query = query.filter(db.or_(*clauses))
+  order = [expression.desc() if descending == forward else expression.asc()
+           for name, expression, parse, descending in keys]
+  rows = query.order_by(*order).limit(limit + 1).all()
+  has_more = len(rows) > limit
+  rows = rows[:limit]
+  if not forward:
+      rows.reverse()
+  key_of = lambda row: encode_cursor(*[getattr(row, name) for name, expression, parse, descending in keys])
+  return rows, page_links(rows, key_of, limit, cursor, forward, has_more, link_args)
+
+def keyset_slice(entries, parsers, default_size_key, **link_args):
+  # keyset_page over an ascending list of sort key tuples from the read
+  # model; the cursor is the key itself, so both paginate the same way
+  limit, cursor, forward, values = read_cursor(parsers, default_size_key)
+  if forward:
+      start = bisect_right(entries, tuple(values)) if cursor else 0
+      rows = entries[start:start + limit + 1]
+      has_more = len(rows) > limit
+      rows = rows[:limit]
+  else:
+      end = bisect_left(entries, tuple(values))
+      rows = entries[max(0, end - limit - 1):end]
+      has_more = len(rows) > limit
+      rows = rows[-limit:]
+  return rows, page_links(rows, lambda row: encode_cursor(*row), limit, cursor, forward, has_more, link_args)
+
+def search_by_name(model, search_term):
+  if read_model.loaded:
+      return search_read_model(model, search_term)
+  # ILIKE '%term%' is served by the pg_trgm GIN index on name; on Postgres the
+  # matches are ranked by trigram similarity, elsewhere alphabetically
+  escaped = search_term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+  matches = db.session.query(model.id, model.name).filter(model.name.ilike('%' + escaped + '%', escape='\\'))
+  keys = [('name', model.name, str, False), ('id', model.id, int, False)]
+  if db.engine.dialect.name == 'postgresql':
+      # similarity() is a real; as a fixed-point numeric the value in the
+      # cursor compares exactly equal to the one in the table on the next page
+      rank = db.cast(db.func.similarity(model.name, search_term), db.Numeric(6, 5))
+      matches = matches.add_columns(rank.label('rank'))
+      keys.insert(0, ('rank', rank, Decimal, True))
+  rows, pagination = keyset_page(matches, keys, 'SEARCH_RESULT_LIMIT', search_term=search_term)
+  # counting stops at SEARCH_COUNT_CAP so a broad term never scans the table
+  count_cap = app.config['SEARCH_COUNT_CAP']
+  total = db.session.query(db.func.count()).select_from(
+      matches.with_entities(model.id).limit(count_cap + 1).subquery()).scalar()
+  return {
+      "count": min(total, count_cap),
+      "count_capped": total > count_cap,
+      "data": [{"id": row.id, "name": row.name} for row in rows]
+  }, pagination
+
+def search_read_model(model, search_term):
+  # substring match over the read model's name index, ordered by name
+  index = 'venues_by_name' if model is Venue else 'artists_by_name'
+  matches = read_model.name_matches(index, search_term)
+  rows, pagination = keyset_slice(matches, [str, int], 'SEARCH_RESULT_LIMIT', search_term=search_term)
+  count_cap = app.config['SEARCH_COUNT_CAP']
+  return {
+      "count": min(len(matches), count_cap),
+      "count_capped": len(matches) > count_cap,
+      "data": [{"id": record.id, "name": record.name}
+               for record in read_model.many(model.__tablename__, [id for name, id in rows])]
+  }, pagination
+
+def page_version(query):
+  # (last_modified, version) for cache.conditional: the version is the whole
+  # row, last_modified its latest timestamp
+  row = query.first()
+  if row is None:
+      return None
+  times = [value for value in row if isinstance(value, datetime)]
+  return max(times) if times else None, list(row)
+
+def started_shows(*conditions):
+  # shows move from upcoming to past as they start, which changes the pages
+  # listing them without any write
+  return db.session.query(db.func.max(Show.start_time)) \
+    .filter(Show.start_time <= datetime.now(), *conditions).as_scalar()
+
+def venues_version():
+  if read_model.loaded:
+      return read_model.validators(datetime.now())
+  return page_version(db.session.query(db.func.max(Venue.updated_at), db.func.count(Venue.id), started_shows()))
+
+def artists_version():
+  if read_model.loaded:
+      return read_model.validators(datetime.now())
+  return page_version(db.session.query(db.func.max(Artist.updated_at), db.func.count(Artist.id)))
+
+def shows_version():
+  if read_model.loaded:
+      return read_model.validators(datetime.now())
+  return page_version(db.session.query(
+      db.func.max(Show.updated_at),
+      db.func.count(Show.id),
+      db.session.query(db.func.max(Venue.updated_at)).as_scalar(),
+      db.session.query(db.func.max(Artist.updated_at)).as_scalar()
+  ))
+
+def detail_version(model, entity_id, show_column, counterpart, counterpart_column):
+  # the entity itself, the names and images of the other side of its shows,
+  # how many shows there are and which of them have started, and the other
+  # side in the same city, which the matches come from
+  condition = show_column == entity_id
+  same_city = db.and_(counterpart.state == model.state, counterpart.city == model.city)
+  return page_version(db.session.query(
+      model.updated_at,
+      db.session.query(db.func.max(counterpart.updated_at)).select_from(counterpart)
+        .join(Show, counterpart_column == counterpart.id).filter(condition).as_scalar(),
+      db.session.query(db.func.count(Show.id)).filter(condition).as_scalar(),
+      started_shows(condition),
+      db.session.query(db.func.max(counterpart.updated_at)).filter(same_city).as_scalar(),
+      db.session.query(db.func.count(counterpart.id)).filter(same_city).as_scalar()
+  ).filter(model.id == entity_id))
+
+def venue_version(venue_id):
+  if read_model.loaded:
+      # any change at all moves the ETag of every detail page, which is
+      # coarse but costs no query
+      return read_model.validators(datetime.now()) if read_model.venue(venue_id) else None
+  return detail_version(Venue, venue_id, Show.venue_id, Artist, Show.artist_id)
+
+def artist_version(artist_id):
+  if read_model.loaded:
+      return read_model.validators(datetime.now()) if read_model.artist(artist_id) else None
+  return detail_version(Artist, artist_id, Show.artist_id, Venue, Show.venue_id)
 
 #----------------------------------------------------------------------------#
 # Controllers.
@@ -46,61 +294,165 @@ def index():
   return render_template('pages/home.html')
 
 
+@app.route('/autocomplete')
+def autocomplete():
+  # served from the in-memory name index, never from the database
+  suggestions = name_index.search(request.args.get('q', ''), app.config['AUTOCOMPLETE_LIMIT'])
+  return jsonify({
+    "venues": suggestions.get('venues', []),
+    "artists": suggestions.get('artists', [])
+  })
+
+
+#  Browse
+#  ----------------------------------------------------------------
+
+BROWSE_MODELS = {
+  'venues': (Venue, Venue.seeking_talent),
+  'artists': (Artist, Artist.seeking_venue),
+}
+
+def has_genre(model, genre):
+  if db.engine.dialect.name == 'postgresql':
+      # genres @> ARRAY[genre] is answered by the GIN index on genres
+      return model.genres.op('@>')(db.cast(array([genre]), model.genres.type.impl))
+  return db.cast(model.genres, db.String).like('%' + json.dumps(genre) + '%')
+
+@app.route('/browse/<any(venues, artists):kind>')
+def browse(kind):
+  model, seeking_column = BROWSE_MODELS[kind]
+  filters = dict((name, request.args[name]) for name in ('genre', 'state', 'city', 'seeking') if request.args.get(name))
+
+  def conditions(*ignored):
+      # each facet is counted under every filter except its own, so its
+      # values stay selectable
+      clauses = []
+      if 'genre' in filters and 'genre' not in ignored:
+          clauses.append(has_genre(model, filters['genre']))
+      if 'state' in filters and 'state' not in ignored:
+          clauses.append(model.state == filters['state'])
+      if 'city' in filters and 'city' not in ignored:
+          clauses.append(model.city == filters['city'])
+      if 'seeking' in filters and 'seeking' not in ignored:
+          clauses.append(seeking_column == (filters['seeking'] == 'y'))
+      return clauses
+
+  def facet_counts():
+      genre_counts = db.session.query(*[
+          db.func.sum(db.case([(has_genre(model, genre), 1)], else_=0))
+          for genre, label in genres_choices
+      ]).filter(*conditions('genre')).one()
+      locations = db.session.query(model.state, model.city, db.func.count(model.id)) \
+          .filter(*conditions('state', 'city')) \
+          .group_by(model.state, model.city) \
+          .order_by(model.state, model.city)
+      seeking = db.session.query(seeking_column, db.func.count(model.id)) \
+          .filter(*conditions('seeking')) \
+          .filter(seeking_column.isnot(None)) \
+          .group_by(seeking_column)
+      return {
+        "genres": [[genre, count] for (genre, label), count in zip(genres_choices, genre_counts) if count],
+        "locations": [[state, city, count] for state, city, count in locations],
+        "seeking": [['y' if flag else 'n', count] for flag, count in seeking]
+      }
+
+  # facet counts only change when a venue or artist is written, so they are
+  # cached until Venue/Artist invalidate 'facets:<kind>'
+  facets = page_cache.fetch('facets:' + kind, json.dumps(filters, sort_keys=True), facet_counts)
+  rows, pagination = keyset_page(
+      db.session.query(model.id, model.name).filter(*conditions()),
+      [('name', model.name, str, False), ('id', model.id, int, False)],
+      'BROWSE_PER_PAGE', kind=kind, **filters)
+  return render_template('pages/browse.html', kind=kind, filters=filters, facets=facets,
+                         results=[{"id": row.id, "name": row.name} for row in rows], pagination=pagination)
+
+
 #  Venues
 #  ----------------------------------------------------------------
 
 @app.route('/venues')
+@conditional(venues_version)
+@page_cache.cached('venues')
 def venues():
-  current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-  venue_query = Venue.query.order_by(Venue.state, Venue.city).all()
+  if read_model.loaded:
+      entries, pagination = keyset_slice(read_model.index('venues_by_area'), [str, str, int], 'VENUES_PER_PAGE')
+      current_time = datetime.now()
+      venue_query = [{
+        "id": venue.id,
+        "name": venue.name,
+        "city": venue.city,
+        "state": venue.state,
+        "num_upcoming_shows": read_model.upcoming_count(venue.id, current_time)
+      } for venue in read_model.many('Venue', [id for state, city, id in entries])]
+      return render_template('pages/venues.html', areas=group_areas(venue_query), pagination=pagination)
+  # upcoming counts come from the maintained ShowCount table, so the page
+  # never touches Show
+  venue_query = db.session.query(
+      Venue.id,
+      Venue.name,
+      Venue.city,
+      Venue.state,
+      db.func.coalesce(ShowCount.upcoming_shows, 0).label('num_upcoming_shows')
+  ).outerjoin(ShowCount, db.and_(ShowCount.kind == 'venue', ShowCount.entity_id == Venue.id))
+  venue_query, pagination = keyset_page(venue_query, [
+      ('state', Venue.state, str, False),
+      ('city', Venue.city, str, False),
+      ('id', Venue.id, int, False)
+  ], 'VENUES_PER_PAGE')
+  return render_template('pages/venues.html', areas=group_areas(venue._asdict() for venue in venue_query),
+                         pagination=pagination)
+
+def group_areas(venues):
   city_and_state = ''
   data = []
-  for venue in venue_query:
-      upcoming_shows = venue.shows.filter(Show.start_time > current_time).all()
-      if city_and_state == venue.city + venue.state:
+  for venue in venues:
+      if city_and_state == venue["city"] + venue["state"]:
           data[len(data) - 1]["venues"].append({
-            "id": venue.id,
-            "name": venue.name,
-            "num_upcoming_shows": len(upcoming_shows)
+            "id": venue["id"],
+            "name": venue["name"],
+            "num_upcoming_shows": venue["num_upcoming_shows"]
           })
       else:
-          city_and_state = venue.city + venue.state
+          city_and_state = venue["city"] + venue["state"]
           data.append({
-            "city": venue.city,
-            "state": venue.state,
+            "city": venue["city"],
+            "state": venue["state"],
             "venues": [{
-              "id": venue.id,
-              "name": venue.name,
-              "num_upcoming_shows": len(upcoming_shows)
+              "id": venue["id"],
+              "name": venue["name"],
+              "num_upcoming_shows": venue["num_upcoming_shows"]
             }]
           })
+  return data
 
-  return render_template('pages/venues.html', areas=data);
-
-@app.route('/venues/search', methods=['POST'])
+@app.route('/venues/search', methods=['GET', 'POST'])
 def search_venues():
-  venue_query = Venue.query.filter(Venue.name.ilike('%' + request.form['search_term'] + '%'))
-  venue_list = list(map(Venue.short, venue_query))
-  response = {
-      "count": len(venue_list),
-      "data": venue_list
-  }
-  return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
+  # GET serves the next/previous links of a result page
+  search_term = request.values.get('search_term', '')
+  response, pagination = search_by_name(Venue, search_term)
+  return render_template('pages/search_venues.html', results=response, search_term=search_term, pagination=pagination)
 
 @app.route('/venues/<int:venue_id>')
+@conditional(venue_version)
+@page_cache.cached('venue:{venue_id}')
 def show_venue(venue_id):
-    venue_query = Venue.query.get(venue_id)
+    # read model records duck-type the models, so the serializers apply as is
+    venue_query = read_model.venue(venue_id) if read_model.loaded else Venue.query.get(venue_id)
     if venue_query:
         venue_details = Venue.details(venue_query)
-        current_time = datetime.now()
-        new_shows_query = Show.query.options(db.joinedload(Show.Venue)).filter(Show.venue_id == venue_id).filter(Show.start_time > current_time).all()
-        new_shows_list = list(map(Show.artist_details, new_shows_query))
+        if read_model.loaded:
+            shows_query = read_model.venue_shows(venue_id)
+        else:
+            shows_query = Show.query.options(db.joinedload(Show.Artist)).filter(Show.venue_id == venue_id).order_by(Show.start_time).all()
+        past_shows_list, new_shows_list = split_shows(shows_query, Show.artist_details)
+        format_show_times(past_shows_list + new_shows_list)
         venue_details["upcoming_shows"] = new_shows_list
         venue_details["upcoming_shows_count"] = len(new_shows_list)
-        past_shows_query = Show.query.options(db.joinedload(Show.Venue)).filter(Show.venue_id == venue_id).filter(Show.start_time <= current_time).all()
-        past_shows_list = list(map(Show.artist_details, past_shows_query))
         venue_details["past_shows"] = past_shows_list
         venue_details["past_shows_count"] = len(past_shows_list)
+        venue_details["matches"] = match_index.matches(
+            'venue', venue_query.state, venue_query.city, venue_query.genres, app.config['MATCH_LIMIT']) \
+            if venue_query.seeking_talent else []
         return render_template('pages/show_venue.html', venue=venue_details)
     return render_template('errors/404.html')
 
@@ -155,35 +507,47 @@ def delete_venue(venue_id):
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
+@conditional(artists_version)
+@page_cache.cached('artists')
 def artists():
-  artist_query = Artist.query.all()
-  artist_list = list(map(Artist.short, artist_query))
-  return render_template('pages/artists.html', artists=artist_list)
+  if read_model.loaded:
+      entries, pagination = keyset_slice(read_model.index('artists_by_name'), [str, int], 'ARTISTS_PER_PAGE')
+      artist_list = [{"id": artist.id, "name": artist.name}
+                     for artist in read_model.many('Artist', [id for name, id in entries])]
+      return render_template('pages/artists.html', artists=artist_list, pagination=pagination)
+  artist_query, pagination = keyset_page(db.session.query(Artist.id, Artist.name), [
+      ('name', Artist.name, str, False),
+      ('id', Artist.id, int, False)
+  ], 'ARTISTS_PER_PAGE')
+  artist_list = [{"id": artist.id, "name": artist.name} for artist in artist_query]
+  return render_template('pages/artists.html', artists=artist_list, pagination=pagination)
 
-@app.route('/artists/search', methods=['POST'])
+@app.route('/artists/search', methods=['GET', 'POST'])
 def search_artists():
-  artist_query = Artist.query.filter(Artist.name.ilike('%' + request.form['search_term'] + '%'))
-  artist_list = list(map(Artist.short, artist_query))
-  response = {
-    "count": len(artist_list),
-    "data": artist_list
-  }
-  return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
+  search_term = request.values.get('search_term', '')
+  response, pagination = search_by_name(Artist, search_term)
+  return render_template('pages/search_artists.html', results=response, search_term=search_term, pagination=pagination)
 
 @app.route('/artists/<int:artist_id>')
+@conditional(artist_version)
+@page_cache.cached('artist:{artist_id}')
 def show_artist(artist_id):
-  artist_query = Artist.query.get(artist_id)
+  artist_query = read_model.artist(artist_id) if read_model.loaded else Artist.query.get(artist_id)
   if artist_query:
       artist_details = Artist.details(artist_query)
-      current_time = datetime.now()
-      new_shows_query = Show.query.options(db.joinedload(Show.Artist)).filter(Show.artist_id == artist_id).filter(Show.start_time > current_time).all()
-      new_shows_list = list(map(Show.venue_details, new_shows_query))
+      if read_model.loaded:
+          shows_query = read_model.artist_shows(artist_id)
+      else:
+          shows_query = Show.query.options(db.joinedload(Show.Venue)).filter(Show.artist_id == artist_id).order_by(Show.start_time).all()
+      past_shows_list, new_shows_list = split_shows(shows_query, Show.venue_details)
+      format_show_times(past_shows_list + new_shows_list)
       artist_details["upcoming_shows"] = new_shows_list
       artist_details["upcoming_shows_count"] = len(new_shows_list)
-      past_shows_query = Show.query.options(db.joinedload(Show.Artist)).filter(Show.artist_id == artist_id).filter(Show.start_time <= current_time).all()
-      past_shows_list = list(map(Show.venue_details, past_shows_query))
       artist_details["past_shows"] = past_shows_list
       artist_details["past_shows_count"] = len(past_shows_list)
+      artist_details["matches"] = match_index.matches(
+          'artist', artist_query.state, artist_query.city, artist_query.genres, app.config['MATCH_LIMIT']) \
+          if artist_query.seeking_venue else []
       return render_template('pages/show_artist.html', artist=artist_details)
   return render_template('errors/404.html')
 
@@ -324,11 +688,41 @@ def create_artist_submission():
 #  ----------------------------------------------------------------
 
 @app.route('/shows')
+@conditional(shows_version)
+@page_cache.cached('shows')
 def shows():
-  shows_query = Show.query.all()
-  shows_list = list(map(Show.details, shows_query))
-  
-  return render_template('pages/shows.html', shows=shows_list)
+  if read_model.loaded:
+      entries, pagination = keyset_slice(read_model.index('shows_by_start'), [datetime.fromisoformat, int],
+                                         'SHOWS_PER_PAGE')
+      shows_list = [Show.details(show) for show in read_model.many('Show', [id for start_time, id in entries])]
+      format_show_times(shows_list)
+      return render_template('pages/shows.html', shows=shows_list, pagination=pagination)
+  shows_query = db.session.query(
+      Show.id,
+      Show.start_time,
+      Show.end_time,
+      Show.venue_id,
+      Venue.name.label('venue_name'),
+      Show.artist_id,
+      Artist.name.label('artist_name'),
+      Artist.image_link.label('artist_image_link')
+  ).join(Venue, Show.venue_id == Venue.id) \
+   .join(Artist, Show.artist_id == Artist.id)
+  rows, pagination = keyset_page(shows_query, [
+      ('start_time', Show.start_time, datetime.fromisoformat, False),
+      ('id', Show.id, int, False)
+  ], 'SHOWS_PER_PAGE')
+  shows_list = [{
+      'venue_id': row.venue_id,
+      'venue_name': row.venue_name,
+      'artist_id': row.artist_id,
+      'artist_name': row.artist_name,
+      'artist_image_link': row.artist_image_link,
+      'start_time': row.start_time
+  } for row in rows]
+  format_show_times(shows_list)
+
+  return render_template('pages/shows.html', shows=shows_list, pagination=pagination)
 
 @app.route('/shows/create')
 def create_shows():
@@ -338,17 +732,269 @@ def create_shows():
 
 @app.route('/shows/create', methods=['POST'])
 def create_show_submission():
+  form = ShowForm(request.form)
+  if not form.validate():
+    for field, messages in form.errors.items():
+        flash('Show could not be listed. %s: %s' % (getattr(form, field).label.text, ' '.join(messages)))
+    return render_template('forms/new_show.html', form=form)
   try:
-      new_show = Show(venue_id=request.form['venue_id'],
-                      artist_id=request.form['artist_id'],
-                      start_time=request.form['start_time'])
-      Show.insert(new_show)
-      # on successful db insert, flash success
-      flash('Show was successfully listed!')
-  except SQLAlchemyError as e:
+      duration = DEFAULT_SHOW_DURATION
+      if form.duration.data:
+          duration = timedelta(minutes=form.duration.data)
+      start_times = show_series(form.start_time.data,
+                                repeat=form.repeat.data,
+                                count=form.repeat_count.data,
+                                until=form.repeat_until.data,
+                                limit=app.config['SHOW_SERIES_LIMIT'])
+      new_shows = [Show(venue_id=form.venue_id.data,
+                        artist_id=form.artist_id.data,
+                        start_time=start_time,
+                        end_time=start_time + duration) for start_time in start_times]
+      if len(new_shows) == 1:
+          Show.insert(new_shows[0])
+          # on successful db insert, flash success
+          flash('Show was successfully listed!')
+      else:
+          Show.insert_many(new_shows)
+          flash('%d shows were successfully listed!' % len(new_shows))
+  except BookingConflict as e:
+        flash('Show could not be listed. ' + str(e))
+  except (SQLAlchemyError, ValueError) as e:
         flash('An error occurred. Show could not be listed.')
   return render_template('pages/home.html')
 
+#  Calendars
+#  ----------------------------------------------------------------
+
+def add_days(day, days):
+  # None past date.min or date.max, which a window near either end reaches
+  try:
+      return day + timedelta(days=days)
+  except OverflowError:
+      return None
+
+def calendar_window():
+  # ?from= and ?to= are inclusive ISO dates, ?by= is day or week
+  try:
+      start = date.fromisoformat(request.args['from']) if request.args.get('from') else date.today()
+      end = date.fromisoformat(request.args['to']) if request.args.get('to') else \
+        add_days(start, app.config['CALENDAR_DAYS'] - 1) or date.max
+  except ValueError:
+      abort(400)
+  bucket = request.args.get('by', 'day')
+  if end < start or bucket not in ('day', 'week'):
+      abort(400)
+  end = min(end, add_days(start, app.config['CALENDAR_MAX_DAYS'] - 1) or date.max)
+  return start, end, bucket
+
+def calendar_shows(start, end, venue_id=None, state=None, city=None):
+  # a range scan over the start_time indexes, so the cost follows the
+  # window rather than the venue's or city's whole history
+  low = datetime.combine(start, time.min)
+  following = add_days(end, 1)
+  high = datetime.combine(following, time.min) if following else datetime.max
+  if read_model.loaded:
+      if venue_id is not None:
+          shows = read_model.venue_shows_between(venue_id, low, high)
+      else:
+          shows = read_model.city_shows_between(state, city, low, high)
+  else:
+      shows = Show.query.options(db.joinedload(Show.Venue), db.joinedload(Show.Artist)) \
+        .filter(Show.start_time >= low, Show.start_time < high)
+      if venue_id is not None:
+          shows = shows.filter(Show.venue_id == venue_id)
+      else:
+          shows = shows.join(Venue, Show.venue_id == Venue.id).filter(Venue.state == state, Venue.city == city)
+      shows = shows.order_by(Show.start_time, Show.id).all()
+  return [dict(Show.details(show), end_time=show.end_time) for show in shows]
+
+def calendar_buckets(shows, bucket):
+  # days (or weeks, keyed by their Monday) that have shows, in order
+  buckets = []
+  for show in shows:
+      day = show['start_time'].date()
+      if bucket == 'week':
+          day -= timedelta(days=day.weekday())
+      if not buckets or buckets[-1]['date'] != day:
+          buckets.append({'date': day, 'shows': []})
+      buckets[-1]['shows'].append(show)
+  return buckets
+
+def calendar(title, **where):
+  start, end, bucket = calendar_window()
+  shows = calendar_shows(start, end, **where)
+  return {
+      'title': title,
+      'from': start,
+      'to': end,
+      'by': bucket,
+      'buckets': calendar_buckets(shows, bucket)
+  }
+
+def calendar_page(data, **link_args):
+  for entry in data['buckets']:
+      format_show_times(entry['shows'])
+  days = (data['to'] - data['from']).days + 1
+  data['link_args'] = dict(link_args, by=data['by'])
+  # no link past date.min or date.max, and a shorter window up to it
+  before, after = add_days(data['from'], -1), add_days(data['to'], 1)
+  data['prev'] = before and {'from': add_days(data['from'], -days) or date.min, 'to': before}
+  data['next'] = after and {'from': after, 'to': add_days(data['to'], days) or date.max}
+  return render_template('pages/calendar.html', calendar=data)
+
+def calendar_json(data):
+  return Response(json.dumps(data, default=json_default), mimetype='application/json')
+
+def venue_calendar(venue_id):
+  venue = read_model.venue(venue_id) if read_model.loaded else Venue.query.get(venue_id)
+  if venue is None:
+      abort(404)
+  return calendar(venue.name, venue_id=venue_id)
+
+def city_calendar():
+  state, city = request.args.get('state'), request.args.get('city')
+  if not state or not city:
+      abort(400)
+  return calendar('%s, %s' % (city, state), state=state, city=city)
+
+@app.route('/venues/<int:venue_id>/calendar')
+@page_cache.cached('venue:{venue_id}')
+def show_venue_calendar(venue_id):
+  return calendar_page(venue_calendar(venue_id), venue_id=venue_id)
+
+@app.route('/calendar')
+@page_cache.cached('shows')
+def show_city_calendar():
+  return calendar_page(city_calendar(), state=request.args['state'], city=request.args['city'])
+
+#  Feeds
+#  ----------------------------------------------------------------
+
+def feed_rows(*conditions):
+  # streamed through a server-side cursor like the /api/v1 lists, so a feed
+  # of any length is written in constant memory
+  return db.session.query(
+      Show.id,
+      Show.start_time,
+      Show.end_time,
+      Show.updated_at,
+      Show.venue_id,
+      Venue.name.label('venue_name'),
+      Venue.address.label('venue_address'),
+      Venue.city.label('venue_city'),
+      Venue.state.label('venue_state'),
+      Show.artist_id,
+      Artist.name.label('artist_name')
+  ).join(Venue, Show.venue_id == Venue.id) \
+   .join(Artist, Show.artist_id == Artist.id) \
+   .filter(*conditions) \
+   .order_by(Show.start_time, Show.id) \
+   .yield_per(app.config['API_STREAM_BATCH'])
+
+def stream_feed(lines, mimetype, filename):
+  response = Response(stream_with_context(lines), mimetype=mimetype)
+  response.headers['Content-Disposition'] = 'inline; filename="%s"' % filename
+  return response
+
+@app.route('/venues/<int:venue_id>/shows.ics')
+@conditional(venue_version)
+def venue_feed(venue_id):
+  venue = Venue.query.get_or_404(venue_id)
+  return stream_feed(ics_feed(venue.name, feed_rows(Show.venue_id == venue_id)),
+                     'text/calendar', 'venue-%d.ics' % venue_id)
+
+@app.route('/artists/<int:artist_id>/shows.ics')
+@conditional(artist_version)
+def artist_feed(artist_id):
+  artist = Artist.query.get_or_404(artist_id)
+  return stream_feed(ics_feed(artist.name, feed_rows(Show.artist_id == artist_id)),
+                     'text/calendar', 'artist-%d.ics' % artist_id)
+
+@app.route('/shows.csv')
+@conditional(shows_version)
+def shows_csv():
+  return stream_feed(csv_feed(feed_rows()), 'text/csv', 'shows.csv')
+
+#  API
+#  ----------------------------------------------------------------
+
+def json_default(value):
+  # dates and datetimes alike
+  if isinstance(value, date):
+      return value.isoformat()
+  raise TypeError(repr(value))
+
+def stream_json(rows, serializer):
+  # rows is iterated lazily inside the response body and encoded one at a
+  # time, so neither the result set nor the JSON document is ever held whole
+  def generate():
+      yield '{"data": ['
+      for index, row in enumerate(rows):
+          yield (',' if index else '') + json.dumps(serializer(row), default=json_default)
+      yield ']}'
+  return Response(stream_with_context(generate()), mimetype='application/json')
+
+@app.route('/api/v1/venues')
+def api_venues():
+  # yield_per fetches through a server-side cursor in API_STREAM_BATCH chunks
+  venue_query = Venue.query.order_by(Venue.id).yield_per(app.config['API_STREAM_BATCH'])
+  return stream_json(venue_query, Venue.details)
+
+@app.route('/api/v1/artists')
+def api_artists():
+  artist_query = Artist.query.order_by(Artist.id).yield_per(app.config['API_STREAM_BATCH'])
+  return stream_json(artist_query, Artist.details)
+
+@app.route('/api/v1/shows')
+def api_shows():
+  shows_query = db.session.query(
+      Show.id,
+      Show.start_time,
+      Show.venue_id,
+      Venue.name.label('venue_name'),
+      Show.artist_id,
+      Artist.name.label('artist_name'),
+      Artist.image_link.label('artist_image_link')
+  ).join(Venue, Show.venue_id == Venue.id) \
+   .join(Artist, Show.artist_id == Artist.id) \
+   .order_by(Show.start_time, Show.id) \
+   .yield_per(app.config['API_STREAM_BATCH'])
+  return stream_json(shows_query, lambda row: row._asdict())
+
+@app.route('/api/v1/venues/<int:venue_id>/calendar')
+def api_venue_calendar(venue_id):
+  return calendar_json(venue_calendar(venue_id))
+
+@app.route('/api/v1/calendar')
+def api_city_calendar():
+  return calendar_json(city_calendar())
+
+#  Debug
+#  ----------------------------------------------------------------
+
+@app.route('/__debug/queries')
+def debug_queries():
+  # hidden unless a token is configured and presented
+  token = app.config.get('DEBUG_QUERIES_TOKEN')
+  presented = request.headers.get('X-Debug-Token') or request.args.get('token', '')
+  if not token or not app.config['QUERY_INSTRUMENTATION'] or not hmac.compare_digest(presented, token):
+      abort(404)
+  return jsonify({
+    "n_plus_one_threshold": query_recorder.n_plus_one_threshold,
+    "requests": query_recorder.recent()
+  })
+
+@app.route('/__debug/read-model')
+def debug_read_model():
+  token = app.config.get('DEBUG_QUERIES_TOKEN')
+  presented = request.headers.get('X-Debug-Token') or request.args.get('token', '')
+  if not token or not read_model.loaded or not hmac.compare_digest(presented, token):
+      abort(404)
+  return jsonify({
+    "memory": read_model.memory_report(),
+    "problems": read_model.check() if request.args.get('check') else None
+  })
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
@@ -368,6 +1014,48 @@ if not app.debug:
     app.logger.addHandler(file_handler)
     app.logger.info('errors')
 
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+@app.cli.command('roll-over-show-counts')
+@click.option('--rebuild', is_flag=True, help='Recount every show instead of rolling over.')
+def roll_over_show_counts_command(rebuild):
+  """Move shows that have started from upcoming to past in ShowCount.
+
+  Meant to run on a schedule (e.g. every few minutes from cron); the
+  upcoming counts on /venues are as fresh as the last run."""
+  if rebuild:
+      rebuild_show_counts()
+      db.session.commit()
+  else:
+      roll_over_show_counts()
+  page_cache.invalidate('venues')
+
+@app.cli.command('read-model')
+@click.argument('action', type=click.Choice(['check', 'report']))
+def read_model_command(action):
+  """Load the in-memory read model and check it or report its size.
+
+  `check` loads the model and compares every record and index with the
+  database; use /__debug/read-model?check=1 to check a running worker."""
+  read_model.db = db
+  read_model.load()
+  if action == 'check':
+      problems = read_model.check()
+      for problem in problems:
+          click.echo(problem, err=True)
+      click.echo('%d problems' % len(problems))
+      if problems:
+          raise SystemExit(1)
+  else:
+      report = read_model.memory_report()
+      for table in ('Venue', 'Artist', 'Show'):
+          click.echo('%-8s %8d records %12d bytes' % (table, report[table]['records'], report[table]['bytes']))
+      for name, size in sorted(report['indexes'].items()):
+          click.echo('%-24s %12d bytes' % (name, size))
+      click.echo('total %d bytes' % report['total_bytes'])
+
 #----------------------------------------------------------------------------#
 # Launch.
 #----------------------------------------------------------------------------#
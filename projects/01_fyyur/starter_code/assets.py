@@ -0,0 +1,146 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+import time
+import click
+from flask import abort, current_app, request, send_file, url_for
+from flask.cli import with_appcontext
+
+# text assets are worth compressing; images and woff fonts already are
+COMPRESSIBLE = ('.css', '.js', '.map', '.svg', '.eot', '.ttf', '.otf', '.json')
+SKIPPED = ('.gitkeep',)
+CSS_URL = re.compile(r'url\((["\']?)([^)"\'?#]+)([^)"\']*)\1\)')
+
+
+def fingerprint(path, content):
+    # css/main.css -> css/main.3f2a9c1b.css
+    root, extension = os.path.splitext(path)
+    return '%s.%s%s' % (root, hashlib.sha256(content).hexdigest()[:8], extension)
+
+
+def source_files(static_folder, output_folder):
+    # a file with a .min twin is the unminified duplicate and is not shipped
+    for directory, subdirectories, files in os.walk(static_folder):
+        subdirectories[:] = [name for name in subdirectories
+                             if os.path.normpath(os.path.join(directory, name)) != os.path.normpath(output_folder)]
+        for name in sorted(files):
+            root, extension = os.path.splitext(name)
+            if name in SKIPPED or (not root.endswith('.min') and root + '.min' + extension in files):
+                continue
+            path = os.path.join(directory, name)
+            yield os.path.relpath(path, static_folder).replace(os.sep, '/')
+
+
+def rewrite_css_urls(path, content, manifest):
+    # relative url()s in stylesheets point at the fingerprinted files too
+    def replace(match):
+        quote, target, suffix = match.groups()
+        resolved = os.path.normpath(os.path.join(os.path.dirname(path), target)).replace(os.sep, '/')
+        if resolved not in manifest:
+            return match.group(0)
+        hashed = os.path.relpath(manifest[resolved], os.path.dirname(path)).replace(os.sep, '/')
+        return 'url(%s%s%s%s)' % (quote, hashed, suffix, quote)
+    return CSS_URL.sub(replace, content.decode('utf-8')).encode('utf-8')
+
+
+def build_assets(static_folder, output_folder):
+    """Copy static/ into output_folder under content-hashed names, with .gz
+    and (when the brotli package is installed) .br variants next to every
+    compressible file, and write manifest.json mapping source paths to
+    hashed ones. Returns the manifest."""
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+    if os.path.isdir(output_folder):
+        shutil.rmtree(output_folder)
+    manifest = {}
+    # stylesheets last, so the files they reference are already hashed
+    paths = sorted(source_files(static_folder, output_folder), key=lambda path: (path.endswith('.css'), path))
+    for path in paths:
+        with open(os.path.join(static_folder, path), 'rb') as source:
+            content = source.read()
+        if path.endswith('.css'):
+            content = rewrite_css_urls(path, content, manifest)
+        manifest[path] = fingerprint(path, content)
+        target = os.path.join(output_folder, manifest[path])
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as output:
+            output.write(content)
+        if path.endswith(COMPRESSIBLE):
+            with open(target + '.gz', 'wb') as output:
+                output.write(gzip.compress(content, 9))
+            if brotli is not None:
+                with open(target + '.br', 'wb') as output:
+                    output.write(brotli.compress(content, quality=11))
+    with open(os.path.join(output_folder, 'manifest.json'), 'w') as output:
+        json.dump(manifest, output, indent=2, sort_keys=True)
+    return manifest
+
+
+class Assets(object):
+    # Serves the output of build_assets under /assets/ and gives templates
+    # asset_url(), which falls back to the plain static URL for anything not
+    # in the manifest (or for every file when no build has been made).
+
+    def __init__(self):
+        self.manifest = {}
+        self.output_folder = None
+
+    def init_app(self, app):
+        self.output_folder = os.path.normpath(
+            os.path.join(app.root_path, app.config.get('ASSETS_BUILD_FOLDER', 'static/build')))
+        self.max_age = app.config.get('ASSETS_MAX_AGE', 31536000)
+        self.manifest = {}
+        if app.config.get('ASSETS_FINGERPRINTED', True):
+            manifest_path = os.path.join(self.output_folder, 'manifest.json')
+            if os.path.exists(manifest_path):
+                with open(manifest_path) as manifest:
+                    self.manifest = json.load(manifest)
+        # the manifest is read once; restart after `flask build-assets`
+        app.add_url_rule('/assets/<path:filename>', 'assets', self.serve)
+        app.add_template_global(self.url, 'asset_url')
+
+    def url(self, path):
+        if path in self.manifest:
+            return url_for('assets', filename=self.manifest[path])
+        return url_for('static', filename=path)
+
+    def serve(self, filename):
+        path = os.path.normpath(os.path.join(self.output_folder, filename))
+        if not path.startswith(self.output_folder + os.sep) or not os.path.isfile(path):
+            abort(404)
+        served, encoding = path, None
+        for candidate, extension in (('br', '.br'), ('gzip', '.gz')):
+            if request.accept_encodings[candidate] and os.path.isfile(path + extension):
+                served, encoding = path + extension, candidate
+                break
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = send_file(served, mimetype=mimetype, conditional=True)
+        # set here rather than through send_file, whose keyword for this was
+        # renamed from cache_timeout to max_age in Flask 2
+        response.cache_control.public = True
+        response.cache_control.max_age = self.max_age
+        response.expires = int(time.time() + self.max_age)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        # the name changes whenever the content does
+        response.cache_control.immutable = True
+        return response
+
+
+assets = Assets()
+
+
+@click.command('build-assets')
+@with_appcontext
+def build_assets_command():
+    """Fingerprint and precompress static/ for the /assets/ route."""
+    output_folder = os.path.join(current_app.root_path, current_app.config.get('ASSETS_BUILD_FOLDER', 'static/build'))
+    manifest = build_assets(current_app.static_folder, output_folder)
+    click.echo('%d assets written to %s' % (len(manifest), output_folder))
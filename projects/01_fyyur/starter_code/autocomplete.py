@@ -0,0 +1,81 @@
+from bisect import bisect_left, insort
+from collections import Counter
+from threading import Lock
+
+
+class PrefixIndex(object):
+    # Sorted list of (key, kind, id) entries searched with bisect. Every word
+    # start of a name is a key, so "pia" finds "The Dueling Pianos Bar".
+
+    def __init__(self):
+        self.entries = []
+        self.names = {}
+        self.kind_counts = Counter()
+        self.lock = Lock()
+
+    def load(self, kind, rows):
+        with self.lock:
+            for id, name in rows:
+                if (kind, id) in self.names:
+                    self._remove(kind, id)
+                if name:
+                    self.names[(kind, id)] = name
+                    self.kind_counts[kind] += 1
+                    self.entries.extend((key, kind, id) for key in self._keys_for(name))
+            self.entries.sort()
+
+    def add(self, kind, id, name):
+        with self.lock:
+            self._remove(kind, id)
+            if name:
+                self.names[(kind, id)] = name
+                self.kind_counts[kind] += 1
+                for key in self._keys_for(name):
+                    insort(self.entries, (key, kind, id))
+
+    def remove(self, kind, id):
+        with self.lock:
+            self._remove(kind, id)
+
+    def search(self, prefix, limit=10):
+        prefix = prefix.strip().lower()
+        results = {}
+        if not prefix:
+            return results
+        with self.lock:
+            seen = set()
+            full = set()
+            kinds = set(kind for kind, count in self.kind_counts.items() if count)
+            position = bisect_left(self.entries, (prefix,))
+            while position < len(self.entries) and self.entries[position][0].startswith(prefix):
+                key, kind, id = self.entries[position]
+                position += 1
+                matches = results.setdefault(kind, [])
+                if (kind, id) in seen or kind in full:
+                    continue
+                seen.add((kind, id))
+                matches.append({'id': id, 'name': self.names[(kind, id)]})
+                if len(matches) >= limit:
+                    full.add(kind)
+                    # a short prefix matches most of the index; stop once
+                    # every kind has its results
+                    if full >= kinds:
+                        break
+        return results
+
+    def _keys_for(self, name):
+        words = name.lower().split()
+        return set(' '.join(words[position:]) for position in range(len(words)))
+
+    def _remove(self, kind, id):
+        name = self.names.pop((kind, id), None)
+        if name is None:
+            return
+        self.kind_counts[kind] -= 1
+        for key in self._keys_for(name):
+            position = bisect_left(self.entries, (key, kind, id))
+            if position < len(self.entries) and self.entries[position] == (key, kind, id):
+                del self.entries[position]
+
+
+name_index = PrefixIndex()
@@ -0,0 +1,279 @@
+"""Route benchmark for Fyyur.
+
+Generates synthetic venues, artists and shows, drives every route in app.py
+through the Flask test client and reports latency percentiles and the number
+of SQL statements each request ran. Exits non-zero when a route goes over its
+statement budget, which is how N+1 regressions show up.
+
+  $ python benchmark.py --scale 1k
+  $ python benchmark.py --scale 100k --database-url postgresql://postgres@localhost:5432/fyyur_bench
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+SCALES = {'1k': 1000, '100k': 100000, '1m': 1000000}
+CHUNK_SIZE = 5000
+GENRES = ['Alternative', 'Blues', 'Classical', 'Country', 'Electronic', 'Folk', 'Funk',
+          'Hip-Hop', 'Jazz', 'Pop', 'Punk', 'R&B', 'Reggae', 'Rock n Roll', 'Soul']
+CITIES = [('San Francisco', 'CA'), ('Los Angeles', 'CA'), ('New York', 'NY'), ('Austin', 'TX'),
+          ('Seattle', 'WA'), ('Chicago', 'IL'), ('Boston', 'MA'), ('Denver', 'CO')]
+WORDS = ['Blue', 'Velvet', 'Hop', 'Piano', 'Sax', 'Garden', 'Electric', 'Moon', 'Royal', 'Wild',
+         'Echo', 'Harbor', 'Golden', 'Static', 'Lantern', 'Fox', 'Orchid', 'Iron', 'Night', 'Owl']
+
+VENUE_FORM = {
+    'name': 'Benchmark Hall', 'genres': ['Jazz', 'Folk'], 'address': '1 Main Street',
+    'city': 'San Francisco', 'state': 'CA', 'phone': '123-123-1234',
+    'website': 'https://example.com', 'facebook_link': 'https://facebook.com/example',
+    'image_link': 'https://example.com/image.jpg', 'seeking_talent': 'y',
+    'seeking_description': 'Looking for a house band',
+}
+ARTIST_FORM = dict(VENUE_FORM, name='Benchmark Band', seeking_venue='y')
+del ARTIST_FORM['address'], ARTIST_FORM['seeking_talent']
+
+# (name, method, path, form data, statement budget); paths are formatted with
+# a random existing venue/artist per iteration.
+#
+# A budget is the number of statements the route runs on the database path
+# (no read model, no page cache), as measured by this script. None of the
+# routes' statement counts grow with the data, so the budget has deliberately
+# no headroom: one extra statement is exactly the N+1 regression this catches.
+# A change that genuinely needs another query raises the budget in the same
+# commit. Conditional GETs include their validator query.
+ROUTES = [
+    ('index', 'GET', '/', None, 0),
+    ('autocomplete', 'GET', '/autocomplete?q={prefix}', None, 0),
+    ('venues', 'GET', '/venues', None, 2),
+    ('search_venues', 'POST', '/venues/search', {'search_term': '{prefix}'}, 2),
+    ('show_venue', 'GET', '/venues/{venue_id}', None, 3),
+    ('create_venue_form', 'GET', '/venues/create', None, 0),
+    ('create_venue_submission', 'POST', '/venues/create', VENUE_FORM, 2),
+    ('edit_venue', 'GET', '/venues/{venue_id}/edit', None, 1),
+    ('edit_venue_submission', 'POST', '/venues/{venue_id}/edit', VENUE_FORM, 4),
+    ('delete_venue', 'DELETE', '/venues/{empty_venue_id}', None, 5),
+    ('artists', 'GET', '/artists', None, 2),
+    ('search_artists', 'POST', '/artists/search', {'search_term': '{prefix}'}, 2),
+    ('show_artist', 'GET', '/artists/{artist_id}', None, 3),
+    ('create_artist_form', 'GET', '/artists/create', None, 0),
+    ('create_artist_submission', 'POST', '/artists/create', ARTIST_FORM, 2),
+    ('edit_artist', 'GET', '/artists/{artist_id}/edit', None, 1),
+    ('edit_artist_submission', 'POST', '/artists/{artist_id}/edit', ARTIST_FORM, 4),
+    ('shows', 'GET', '/shows', None, 2),
+    ('shows_next_page', 'GET', '/shows?after={cursor}', None, 2),
+    ('create_shows', 'GET', '/shows/create', None, 0),
+    ('create_show_submission', 'POST', '/shows/create',
+     {'venue_id': '{venue_id}', 'artist_id': '{artist_id}', 'start_time': '{start_time}'}, 7),
+    # a venue's first show creates its ShowCount row
+    ('create_first_show', 'POST', '/shows/create',
+     {'venue_id': '{empty_venue_id}', 'artist_id': '{artist_id}', 'start_time': '{start_time}'}, 8),
+    ('create_show_series', 'POST', '/shows/create',
+     {'venue_id': '{venue_id}', 'artist_id': '{artist_id}', 'start_time': '{start_time}',
+      'repeat': 'weekly', 'repeat_count': '52'}, 6),
+    ('browse_venues', 'GET', '/browse/venues?genre=Jazz&state=CA', None, 4),
+    ('browse_artists', 'GET', '/browse/artists?seeking=y', None, 4),
+    ('venue_calendar', 'GET', '/venues/{venue_id}/calendar?by=week', None, 2),
+    ('city_calendar', 'GET', '/calendar?state=CA&city=San+Francisco', None, 1),
+    ('api_venue_calendar', 'GET', '/api/v1/venues/{venue_id}/calendar', None, 2),
+    ('api_city_calendar', 'GET', '/api/v1/calendar?state=CA&city=San+Francisco', None, 1),
+    ('venue_feed', 'GET', '/venues/{venue_id}/shows.ics', None, 3),
+    ('artist_feed', 'GET', '/artists/{artist_id}/shows.ics', None, 3),
+    ('shows_csv', 'GET', '/shows.csv', None, 2),
+    ('api_venues', 'GET', '/api/v1/venues', None, 1),
+    ('api_artists', 'GET', '/api/v1/artists', None, 1),
+    ('api_shows', 'GET', '/api/v1/shows', None, 1),
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scale', choices=sorted(SCALES), default='1k',
+                        help='number of synthetic shows (venues and artists scale with it)')
+    parser.add_argument('--shows', type=int, help='exact number of shows, overrides --scale')
+    parser.add_argument('--database-url',
+                        help='database to benchmark against, a temporary SQLite file by default')
+    parser.add_argument('--regenerate', action='store_true',
+                        help='drop and recreate the tables even if they already hold data')
+    parser.add_argument('--iterations', type=int, default=20, help='requests per route')
+    parser.add_argument('--cache', action='store_true', help='leave the rendered page cache on')
+    parser.add_argument('--read-model', action='store_true', help='serve GET routes from the in-memory read model')
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+
+def name(rng, suffix):
+    return '%s %s %s' % (rng.choice(WORDS), rng.choice(WORDS), suffix)
+
+
+def insert_chunked(db, table, rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= CHUNK_SIZE:
+            db.session.execute(table.insert(), chunk)
+            db.session.commit()
+            chunk = []
+    if chunk:
+        db.session.execute(table.insert(), chunk)
+        db.session.commit()
+
+
+def generate(db, Venue, Artist, Show, show_count, rng):
+    venue_count = max(1, show_count // 20)
+    artist_count = max(1, show_count // 10)
+
+    def people(count, suffix, seeking_field):
+        for index in range(count):
+            city, state = rng.choice(CITIES)
+            yield {
+                'name': name(rng, '%s %d' % (suffix, index)), 'genres': rng.sample(GENRES, 2),
+                'city': city, 'state': state, 'phone': '123-123-1234',
+                'website': 'https://example.com', 'facebook_link': 'https://facebook.com/example',
+                'image_link': 'https://example.com/image.jpg', seeking_field: rng.random() < 0.3,
+                'seeking_description': '',
+            }
+
+    insert_chunked(db, Venue.__table__,
+                   (dict(row, address='1 Main Street') for row in people(venue_count, 'Hall', 'seeking_talent')))
+    insert_chunked(db, Artist.__table__, people(artist_count, 'Band', 'seeking_venue'))
+    # shows fill two-hour slots from three years ago to a year ahead, and no
+    # venue or artist gets two shows in one slot, which would be a double
+    # booking
+    first_slot = datetime.now().replace(minute=0, second=0, microsecond=0) - timedelta(days=3 * 365)
+    booked = set()
+
+    def shows():
+        for index in range(show_count):
+            while True:
+                venue_id, artist_id = rng.randint(1, venue_count), rng.randint(1, artist_count)
+                slot = rng.randrange(4 * 365 * 12)
+                if ('venue', venue_id, slot) not in booked and ('artist', artist_id, slot) not in booked:
+                    break
+            booked.update((('venue', venue_id, slot), ('artist', artist_id, slot)))
+            start_time = first_slot + timedelta(hours=2 * slot)
+            yield {'venue_id': venue_id, 'artist_id': artist_id,
+                   'start_time': start_time, 'end_time': start_time + timedelta(hours=2)}
+
+    insert_chunked(db, Show.__table__, shows())
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def fill(template, values):
+    if template is None:
+        return None
+    if isinstance(template, dict):
+        return dict((key, fill(value, values)) for key, value in template.items())
+    if isinstance(template, list):
+        return template
+    return template.format(**values)
+
+
+def main():
+    args = parse_args()
+    database_url = args.database_url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'fyyur_bench.db')
+    # config.py reads DATABASE_URL, so it has to be set before the app is imported
+    os.environ['DATABASE_URL'] = database_url
+    from sqlalchemy import event
+    from app import app, encode_cursor
+    from models import db, Venue, Artist, Show, rebuild_show_counts
+    from cache import page_cache
+    from readmodel import read_model
+
+    app.config['PAGE_CACHE_ENABLED'] = args.cache
+    page_cache.init_app(app)
+    if args.read_model and not app.config['READ_MODEL_ENABLED']:
+        app.config['READ_MODEL_ENABLED'] = True
+        read_model.init_app(app, db)
+    rng = random.Random(args.seed)
+    show_count = args.shows or SCALES[args.scale]
+
+    with app.app_context():
+        if db.engine.dialect.name == 'postgresql':
+            db.session.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            db.session.commit()
+        if args.regenerate:
+            db.drop_all()
+        db.create_all()
+        if Show.query.count() == 0:
+            started = time.perf_counter()
+            generate(db, Venue, Artist, Show, show_count, rng)
+            rebuild_show_counts()
+            db.session.commit()
+            print('generated %d shows in %.1fs' % (show_count, time.perf_counter() - started))
+        venue_ids = [id for (id,) in db.session.query(Venue.id).limit(1000)]
+        artist_ids = [id for (id,) in db.session.query(Artist.id).limit(1000)]
+        names = [venue_name for (venue_name,) in db.session.query(Venue.name).limit(100)]
+        cursors = [encode_cursor(start_time.isoformat(), id)
+                   for (start_time, id) in db.session.query(Show.start_time, Show.id).limit(1000)]
+
+        # replicas, when DATABASE_REPLICA_URLS is set, run statements too
+        engines = [db.get_engine(app, bind=bind) for bind in [None] + list(app.config['SQLALCHEMY_BINDS'])]
+
+    statements = []
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', count_statement)
+
+    # requests run outside the setup app context so each one gets a fresh
+    # session and identity map, as it would in production; the first request
+    # loads the autocomplete index (and the read model) and is kept out of
+    # the numbers
+    app.test_client().get('/')
+
+    failures = []
+    print('%-26s %6s %6s %9s %9s %9s' % ('route', 'budget', 'max', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for route_name, method, path, data, budget in ROUTES:
+        timings = []
+        most_statements = 0
+        for iteration in range(args.iterations):
+            values = {
+                'venue_id': rng.choice(venue_ids),
+                'artist_id': rng.choice(artist_ids),
+                'prefix': rng.choice(names)[:3],
+                'cursor': rng.choice(cursors),
+                'start_time': str(datetime(2035, 1, 1) + timedelta(minutes=rng.randrange(10 ** 7))),
+            }
+            if '{empty_venue_id}' in repr((path, data)):
+                with app.app_context():
+                    venue = Venue(**dict(fill(VENUE_FORM, values), seeking_talent=False))
+                    venue.insert()
+                    values['empty_venue_id'] = venue.id
+            client = app.test_client()
+            form = fill(data, values)
+            if method == 'POST':
+                # form posts need a CSRF token bound to this client's session
+                page = client.get('/venues/create').data.decode('utf-8')
+                form['csrf_token'] = re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', page).group(1)
+            del statements[:]
+            started = time.perf_counter()
+            response = client.open(fill(path, values), method=method, data=form)
+            response.get_data()  # streamed bodies only run their queries when read
+            timings.append((time.perf_counter() - started) * 1000)
+            most_statements = max(most_statements, len(statements))
+            if response.status_code >= 400:
+                failures.append('%s returned %d' % (route_name, response.status_code))
+                break
+        if most_statements > budget:
+            failures.append('%s ran %d statements, budget is %d' % (route_name, most_statements, budget))
+        print('%-26s %6d %6d %9.2f %9.2f %9.2f' % (
+            route_name, budget, most_statements,
+            percentile(timings, 0.5), percentile(timings, 0.95), percentile(timings, 0.99)))
+
+    for failure in failures:
+        print('FAIL: ' + failure, file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
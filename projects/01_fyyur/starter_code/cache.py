@@ -0,0 +1,180 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from datetime import timezone
+from functools import wraps
+from threading import Lock
+from flask import current_app, make_response, request, session
+from werkzeug.http import is_resource_modified
+
+
+class MemoryBackend(object):
+    # Bounded LRU held in the worker process. Entries expire after their TTL
+    # and the least recently used entry is evicted once max_entries is hit.
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.counters = {}
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        with self.lock:
+            self.entries[key] = (value, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def counter(self, key):
+        # counters live outside the LRU so a generation is never evicted
+        return self.counters.get(key, 0)
+
+    def incr(self, key):
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+            return self.counters[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.counters.clear()
+
+
+class RedisBackend(object):
+    # Works with any client exposing the redis-py get/set/incr/delete and
+    # scan_iter calls (clear() finds its keys with scan_iter), so a local
+    # stand-in can replace a real server.
+
+    def __init__(self, client, prefix='fyyur:page:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            return None
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, value.encode('utf-8'), ex=ttl or None)
+
+    def counter(self, key):
+        return int(self.client.get(self.prefix + key) or 0)
+
+    def incr(self, key):
+        return self.client.incr(self.prefix + key)
+
+    def clear(self):
+        keys = list(self.client.scan_iter(self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+class PageCache(object):
+    # Rendered pages are stored under '<tag>:<generation>:<path>'. Invalidating
+    # a tag bumps its generation, which drops every page under that tag (all
+    # pagination variants included) without having to enumerate keys.
+
+    def __init__(self, backend=None):
+        self.backend = backend or MemoryBackend()
+        self.default_ttl = 300
+        self.enabled = True
+
+    def init_app(self, app, backend=None):
+        self.enabled = app.config.get('PAGE_CACHE_ENABLED', True)
+        self.default_ttl = app.config.get('PAGE_CACHE_TTL', 300)
+        if backend is not None:
+            self.backend = backend
+        elif app.config.get('PAGE_CACHE_BACKEND', 'memory') == 'redis':
+            import redis
+            self.backend = RedisBackend(redis.Redis.from_url(app.config['PAGE_CACHE_REDIS_URL']))
+        else:
+            self.backend = MemoryBackend(app.config.get('PAGE_CACHE_MAX_ENTRIES', 1000))
+
+    def generation(self, tag):
+        return self.backend.counter('generation:' + tag)
+
+    def invalidate(self, *tags):
+        for tag in set(tags):
+            self.backend.incr('generation:' + tag)
+
+    def fetch(self, tag, key, compute, ttl=None):
+        # same tag/generation scheme for JSON-serialisable values that are not
+        # a whole page, e.g. facet counts shared by many filter combinations
+        if not self.enabled:
+            return compute()
+        full_key = '%s:%s:%s' % (tag, self.generation(tag), key)
+        value = self.backend.get(full_key)
+        if value is not None:
+            return json.loads(value)
+        value = compute()
+        self.backend.set(full_key, json.dumps(value), ttl or self.default_ttl)
+        return value
+
+    def cached(self, tag, ttl=None):
+        # tag is formatted with the view arguments, e.g. 'venue:{venue_id}'
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                # pages that carry flashed messages are per-user, never cache them
+                if not self.enabled or request.method != 'GET' or '_flashes' in session:
+                    return view(*args, **kwargs)
+                page_tag = tag.format(**kwargs)
+                key = '%s:%s:%s' % (page_tag, self.generation(page_tag), request.full_path)
+                page = self.backend.get(key)
+                if page is not None:
+                    return page
+                page = view(*args, **kwargs)
+                if isinstance(page, str):
+                    self.backend.set(key, page, ttl or self.default_ttl)
+                return page
+            return wrapper
+        return decorator
+
+
+def conditional(validators):
+    # validators is called with the view arguments and returns
+    # (last_modified, version) from a cheap query, or None to skip. A client
+    # whose ETag or Last-Modified still matches gets a 304 without the view
+    # running; otherwise the rendered page carries both headers.
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET' or '_flashes' in session:
+                return view(*args, **kwargs)
+            validated = validators(**kwargs)
+            if validated is None:
+                return view(*args, **kwargs)
+            last_modified, version = validated
+            etag = hashlib.sha1(json.dumps(version, default=str).encode('utf-8')).hexdigest()
+            if last_modified is not None:
+                # werkzeug compares naive UTC at one second resolution
+                last_modified = last_modified.astimezone(timezone.utc).replace(tzinfo=None, microsecond=0)
+            if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+                response = make_response(view(*args, **kwargs))
+            else:
+                response = current_app.response_class(status=304)
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            # browsers must revalidate rather than guess a freshness lifetime
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
+
+
+page_cache = PageCache()
@@ -10,4 +10,76 @@ DEBUG = True
 
 
 # TODO IMPLEMENT DATABASE URL
-SQLALCHEMY_DATABASE_URI = 'postgresql://postgres@localhost:5432/fyyur'
+SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'postgresql://postgres@localhost:5432/fyyur')
+
+# Connection pool (Postgres only); pre-ping replaces connections the server
+# has closed instead of failing the request. Statement timeout in ms, 0 = none
+DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE', 5))
+DATABASE_MAX_OVERFLOW = int(os.environ.get('DATABASE_MAX_OVERFLOW', 10))
+DATABASE_POOL_PRE_PING = True
+DATABASE_STATEMENT_TIMEOUT = int(os.environ.get('DATABASE_STATEMENT_TIMEOUT', 30000))
+
+# Read replicas, comma separated. GET requests read from one whose lag is
+# within DATABASE_REPLICA_MAX_LAG seconds and fall back to the primary
+DATABASE_REPLICA_URLS = [url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url]
+DATABASE_REPLICA_MAX_LAG = 5
+DATABASE_REPLICA_LAG_CHECK_INTERVAL = 5
+SQLALCHEMY_BINDS = dict(('replica_%d' % number, url) for number, url in enumerate(DATABASE_REPLICA_URLS))
+
+
+# Pagination
+SHOWS_PER_PAGE = 30
+VENUES_PER_PAGE = 50
+ARTISTS_PER_PAGE = 50
+BROWSE_PER_PAGE = 50
+MAX_PAGE_SIZE = 100
+
+
+# Search
+# results per page
+SEARCH_RESULT_LIMIT = 50
+SEARCH_COUNT_CAP = 1000
+AUTOCOMPLETE_LIMIT = 10
+
+# Calendar window in days when ?to= is not given, and the longest allowed
+CALENDAR_DAYS = 28
+CALENDAR_MAX_DAYS = 366
+
+# Matches listed on venue and artist pages
+MATCH_LIMIT = 6
+
+# Most shows a recurring series may create in one submission
+SHOW_SERIES_LIMIT = 200
+
+# Rows fetched per round trip by the streaming /api/v1 endpoints
+API_STREAM_BATCH = 1000
+
+# Serve listing, search and detail pages from an in-memory copy of venues,
+# artists and shows; it only sees writes made by this process, so enable it
+# for single-worker deployments
+READ_MODEL_ENABLED = os.environ.get('READ_MODEL_ENABLED') == '1'
+
+# Compile every template at startup rather than on first use; workers can
+# share compiled bytecode through a directory on disk
+TEMPLATE_PRECOMPILE = True
+TEMPLATE_BYTECODE_CACHE_DIR = os.environ.get('TEMPLATE_BYTECODE_CACHE_DIR')
+
+# Fingerprinted, precompressed static files written by `flask build-assets`
+# and served under /assets/; templates fall back to /static/ without a build
+ASSETS_FINGERPRINTED = True
+ASSETS_BUILD_FOLDER = 'static/build'
+ASSETS_MAX_AGE = 31536000
+
+# Rendered page cache ('memory' or 'redis')
+PAGE_CACHE_ENABLED = True
+PAGE_CACHE_BACKEND = 'memory'
+PAGE_CACHE_TTL = 300
+PAGE_CACHE_MAX_ENTRIES = 1000
+PAGE_CACHE_REDIS_URL = 'redis://localhost:6379/0'
+
+# Per-request SQL instrumentation; /__debug/queries is only served when
+# DEBUG_QUERIES_TOKEN is set and sent as X-Debug-Token or ?token=
+QUERY_INSTRUMENTATION = True
+N_PLUS_ONE_THRESHOLD = 5
+QUERY_HISTORY_SIZE = 100
+DEBUG_QUERIES_TOKEN = os.environ.get('DEBUG_QUERIES_TOKEN')
@@ -0,0 +1,73 @@
+import csv
+import io
+from datetime import timezone
+
+CSV_COLUMNS = ('id', 'start_time', 'end_time', 'venue_id', 'venue_name', 'venue_city', 'venue_state',
+               'artist_id', 'artist_name')
+
+
+def ics_escape(value):
+    return (value or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def ics_line(name, value):
+    # RFC 5545 lines are at most 75 octets; longer ones continue on lines
+    # starting with a space, split between (not inside) UTF-8 sequences
+    data = ('%s:%s' % (name, value)).encode('utf-8')
+    parts = []
+    limit = 75
+    while len(data) > limit:
+        cut = limit
+        while data[cut] & 0xC0 == 0x80:
+            cut -= 1
+        parts.append(data[:cut])
+        data = data[cut:]
+        limit = 74
+    parts.append(data)
+    return b'\r\n '.join(parts).decode('utf-8') + '\r\n'
+
+
+def ics_time(value):
+    # show times are venue-local, so they are written as floating times
+    return value.strftime('%Y%m%dT%H%M%S')
+
+
+def ics_feed(name, rows):
+    """Yield an iCalendar document with one VEVENT per row, a line at a time.
+    Rows need the columns selected by app.feed_rows."""
+    yield ics_line('BEGIN', 'VCALENDAR')
+    yield ics_line('VERSION', '2.0')
+    yield ics_line('PRODID', '-//Fyyur//Shows//EN')
+    yield ics_line('CALSCALE', 'GREGORIAN')
+    yield ics_line('X-WR-CALNAME', ics_escape(name))
+    for row in rows:
+        location = ', '.join(part for part in (row.venue_name, row.venue_address, row.venue_city, row.venue_state) if part)
+        yield ics_line('BEGIN', 'VEVENT')
+        yield ics_line('UID', 'show-%d@fyyur' % row.id)
+        # the row's own timestamp rather than now, so an unchanged feed is
+        # byte for byte the same and its ETag holds
+        yield ics_line('DTSTAMP', row.updated_at.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ'))
+        yield ics_line('DTSTART', ics_time(row.start_time))
+        yield ics_line('DTEND', ics_time(row.end_time))
+        yield ics_line('SUMMARY', ics_escape('%s at %s' % (row.artist_name, row.venue_name)))
+        yield ics_line('LOCATION', ics_escape(location))
+        yield ics_line('END', 'VEVENT')
+    yield ics_line('END', 'VCALENDAR')
+
+
+def csv_feed(rows):
+    """Yield a CSV document with a header and one line per row."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def line(values):
+        writer.writerow(values)
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return value
+
+    yield line(CSV_COLUMNS)
+    for row in rows:
+        yield line([getattr(row, column).isoformat() if column.endswith('_time') else getattr(row, column)
+                    for column in CSV_COLUMNS])
@@ -0,0 +1,37 @@
+from datetime import datetime
+from functools import lru_cache
+import babel.dates
+import dateutil.parser
+from babel import Locale
+
+DATETIME_FORMATS = {
+    'full': "EEEE MMMM, d, y 'at' h:mma",
+    'medium': "EE MM, dd, y h:mma",
+}
+
+
+@lru_cache(maxsize=64)
+def compiled_pattern(format, locale):
+    # parsing a Babel pattern and loading locale data is the expensive part
+    # of formatting, so do it once per (format, locale)
+    return (babel.dates.parse_pattern(DATETIME_FORMATS.get(format, format)),
+            Locale.parse(locale))
+
+
+def format_datetime(value, format='medium', locale='en_US'):
+    if not isinstance(value, datetime):
+        value = dateutil.parser.parse(value)
+    pattern, locale = compiled_pattern(format, locale)
+    return pattern.apply(value, locale)
+
+
+def format_show_times(shows, format='full', locale='en_US', key='start_time'):
+    # formats a whole list of show dicts in one pass, adding '<key>_formatted';
+    # shows sharing a start time (residencies, festivals) are formatted once
+    formatted = {}
+    for show in shows:
+        value = show[key]
+        if value not in formatted:
+            formatted[value] = format_datetime(value, format, locale)
+        show[key + '_formatted'] = formatted[value]
+    return shows
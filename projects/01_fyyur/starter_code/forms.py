@@ -1,7 +1,8 @@
 from datetime import datetime
 from flask_wtf import Form
-from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField, ValidationError
-from wtforms.validators import DataRequired, AnyOf, URL, Length
+from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, DateField, BooleanField, IntegerField, ValidationError
+from wtforms.validators import DataRequired, AnyOf, URL, Length, NumberRange, Optional
+import dateutil.parser
 import re
 
 state_choices = [
@@ -172,6 +173,17 @@ class ArtistForm(Form):
     )
 
 
+class ShowTimeField(DateTimeField):
+    # reads anything dateutil can, e.g. the 'YYYY-MM-DD HH:MM' the form asks
+    # for or an ISO 8601 timestamp, rather than only `format`
+    def process_formdata(self, valuelist):
+        if valuelist:
+            try:
+                self.data = dateutil.parser.parse(' '.join(valuelist))
+            except (ValueError, OverflowError):
+                self.data = None
+                raise ValueError(self.gettext('Not a valid datetime value'))
+
 class ShowForm(Form):
     artist_id = StringField(
         'artist_id'
@@ -179,9 +191,32 @@ class ShowForm(Form):
     venue_id = StringField(
         'venue_id'
     )
-    start_time = DateTimeField(
+    start_time = ShowTimeField(
         'start_time',
         validators=[DataRequired()],
         default=datetime.today()
     )
+    duration = IntegerField(
+        # minutes; two hours when left empty
+        'duration',
+        validators=[Optional(), NumberRange(min=1, max=24 * 60)]
+    )
+    repeat = SelectField(
+        'repeat',
+        validators=[Optional()],
+        choices=[
+            ('', 'Does not repeat'),
+            ('weekly', 'Weekly'),
+            ('monthly', 'Monthly'),
+        ]
+    )
+    repeat_count = IntegerField(
+        # total number of shows, the first one included
+        'repeat_count',
+        validators=[Optional(), NumberRange(min=1)]
+    )
+    repeat_until = DateField(
+        'repeat_until',
+        validators=[Optional()]
+    )
 
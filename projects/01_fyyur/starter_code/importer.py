@@ -0,0 +1,236 @@
+import csv
+import json
+import click
+from flask.cli import with_appcontext
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.datastructures import MultiDict
+from forms import VenueForm, ArtistForm
+from models import db, Venue, Artist, Show, DEFAULT_SHOW_DURATION, count_shows, touch_parents, booking_conflict, parse_start_time
+from intervals import Timeline, booking_index
+from cache import page_cache
+
+TRUE_VALUES = ('y', 'yes', 'true', 't', '1')
+
+
+def read_rows(path, format):
+    # streams (line number, dict) pairs so memory does not grow with the file
+    with open(path, newline='', encoding='utf-8') as source:
+        if format == 'csv':
+            reader = csv.DictReader(source)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line_number, line in enumerate(source, 1):
+                if line.strip():
+                    yield line_number, json.loads(line)
+
+
+def form_data(row, list_fields=('genres',), bool_fields=()):
+    items = []
+    for field, value in row.items():
+        if value is None:
+            continue
+        if field in list_fields:
+            if isinstance(value, str):
+                value = [genre.strip() for genre in value.split(',') if genre.strip()]
+            items.extend((field, genre) for genre in value)
+        elif field in bool_fields:
+            if str(value).strip().lower() in TRUE_VALUES:
+                items.append((field, 'y'))
+        else:
+            items.append((field, str(value)))
+    return MultiDict(items)
+
+
+def validate_venue(row, context):
+    form = VenueForm(form_data(row, bool_fields=('seeking_talent',)), meta={'csrf': False})
+    if not form.validate():
+        return None, form.errors
+    return {
+        'name': form.name.data,
+        'genres': form.genres.data,
+        'address': form.address.data,
+        'city': form.city.data,
+        'state': form.state.data,
+        'phone': form.phone.data,
+        'website': form.website.data,
+        'facebook_link': form.facebook_link.data,
+        'image_link': form.image_link.data,
+        'seeking_talent': form.seeking_talent.data,
+        'seeking_description': form.seeking_description.data or '',
+    }, None
+
+
+def validate_artist(row, context):
+    form = ArtistForm(form_data(row, bool_fields=('seeking_venue',)), meta={'csrf': False})
+    if not form.validate():
+        return None, form.errors
+    return {
+        'name': form.name.data,
+        'genres': form.genres.data,
+        'city': form.city.data,
+        'state': form.state.data,
+        'phone': form.phone.data,
+        'website': form.website.data,
+        'facebook_link': form.facebook_link.data,
+        'image_link': form.image_link.data,
+        'seeking_venue': form.seeking_venue.data,
+        'seeking_description': form.seeking_description.data or '',
+    }, None
+
+
+def validate_show(row, context):
+    errors = {}
+    values = {}
+    for field, known_ids in (('venue_id', context['venue_ids']), ('artist_id', context['artist_ids'])):
+        try:
+            values[field] = int(row.get(field))
+        except (TypeError, ValueError):
+            errors[field] = ['Not a valid integer.']
+            continue
+        if values[field] not in known_ids:
+            errors[field] = ['No such id.']
+    try:
+        values['start_time'] = parse_start_time(row.get('start_time') or '')
+    except (ValueError, OverflowError):
+        errors['start_time'] = ['Not a valid datetime.']
+    try:
+        if row.get('end_time'):
+            values['end_time'] = parse_start_time(row['end_time'])
+        elif 'start_time' in values:
+            values['end_time'] = values['start_time'] + DEFAULT_SHOW_DURATION
+    except (ValueError, OverflowError):
+        errors['end_time'] = ['Not a valid datetime.']
+    if 'start_time' in values and 'end_time' in values and values['end_time'] <= values['start_time']:
+        errors['end_time'] = ['Has to be after start_time.']
+    if errors:
+        return None, errors
+    keys = (('venue', values['venue_id']), ('artist', values['artist_id']))
+    conflict = booking_conflict(values['venue_id'], values['artist_id'], values['start_time'], values['end_time'])
+    for kind, entity_id in keys:
+        if conflict is None and (kind, entity_id) in context['pending'] and \
+                context['pending'][(kind, entity_id)].overlaps(values['start_time'], values['end_time']):
+            conflict = kind
+    if conflict:
+        return None, {conflict + '_id': ['Already booked at that time.']}
+    # later rows of the same file are checked against this one as well; it
+    # only joins booking_index once its chunk has committed
+    for key in keys:
+        context['pending'].setdefault(key, Timeline()).add(values['start_time'], values['end_time'])
+    return values, None
+
+
+def show_context():
+    # shows are checked against the existing ids up front so one bad foreign
+    # key is reported per row instead of failing its whole chunk
+    return {
+        'venue_ids': set(id for (id,) in db.session.query(Venue.id)),
+        'artist_ids': set(id for (id,) in db.session.query(Artist.id)),
+        'pending': {},
+    }
+
+
+def show_cache_tags(values):
+    return ('venue:%d' % values['venue_id'], 'artist:%d' % values['artist_id'])
+
+
+def count_imported_shows(rows):
+    count_shows([(values['venue_id'], values['artist_id'], values['start_time']) for values in rows])
+    touch_parents([(values['venue_id'], values['artist_id']) for values in rows])
+
+
+def book_imported_shows(rows, context):
+    # the chunk is over: its committed rows are bookings now, and the rows
+    # it lost are not, so neither stays pending
+    for values in rows:
+        booking_index.add(('venue', values['venue_id']), values['start_time'], values['end_time'])
+        booking_index.add(('artist', values['artist_id']), values['start_time'], values['end_time'])
+    context['pending'].clear()
+
+
+# kind: (model, row validator, validation context, listing cache tags,
+#        per-row cache tags, hook run on inserted rows before commit,
+#        hook run on committed rows with the validation context)
+IMPORTS = {
+    'venues': (Venue, validate_venue, lambda: {}, ('venues', 'facets:venues'), lambda values: (), None, None),
+    'artists': (Artist, validate_artist, lambda: {}, ('artists', 'facets:artists'), lambda values: (), None, None),
+    'shows': (Show, validate_show, show_context, ('shows', 'venues'), show_cache_tags, count_imported_shows,
+              book_imported_shows),
+}
+
+
+def insert_chunk(table, chunk, errors, on_insert=None):
+    # one multi-row INSERT per chunk in its own transaction; if the database
+    # rejects the chunk, retry it row by row so only the bad rows are lost
+    try:
+        rows = [values for line_number, values in chunk]
+        db.session.execute(table.insert().values(rows))
+        if on_insert:
+            on_insert(rows)
+        db.session.commit()
+        return rows
+    except SQLAlchemyError:
+        db.session.rollback()
+    inserted = []
+    for line_number, values in chunk:
+        try:
+            db.session.execute(table.insert().values(values))
+            if on_insert:
+                on_insert([values])
+            db.session.commit()
+            inserted.append(values)
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            errors.append((line_number, {'database': [str(e.orig if hasattr(e, 'orig') else e)]}))
+    return inserted
+
+
+def import_file(kind, path, format=None, chunk_size=500):
+    model, validate, make_context, listing_tags, row_tags, on_insert, on_commit = IMPORTS[kind]
+    format = format or ('csv' if path.endswith('.csv') else 'jsonl')
+    context = make_context()
+    errors = []
+    inserted = 0
+    cache_tags = set()
+    chunk = []
+    for line_number, row in read_rows(path, format):
+        values, row_errors = validate(row, context)
+        if row_errors:
+            errors.append((line_number, row_errors))
+            continue
+        chunk.append((line_number, values))
+        if len(chunk) >= chunk_size:
+            rows = insert_chunk(model.__table__, chunk, errors, on_insert)
+            if on_commit:
+                on_commit(rows, context)
+            for values in rows:
+                inserted += 1
+                cache_tags.update(row_tags(values))
+            chunk = []
+    if chunk:
+        rows = insert_chunk(model.__table__, chunk, errors, on_insert)
+        if on_commit:
+            on_commit(rows, context)
+        for values in rows:
+            inserted += 1
+            cache_tags.update(row_tags(values))
+    if inserted:
+        page_cache.invalidate(*(cache_tags | set(listing_tags)))
+    return inserted, errors
+
+
+@click.command('import')
+@click.argument('kind', type=click.Choice(sorted(IMPORTS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', type=click.Choice(['csv', 'jsonl']), default=None,
+              help='Input format, guessed from the file extension by default.')
+@click.option('--chunk-size', default=500, show_default=True,
+              help='Rows per INSERT statement and transaction.')
+@with_appcontext
+def import_command(kind, path, format, chunk_size):
+    """Bulk load venues, artists or shows from a CSV or JSONL file."""
+    inserted, errors = import_file(kind, path, format, chunk_size)
+    for line_number, row_errors in errors:
+        for field, messages in row_errors.items():
+            click.echo('line %d: %s: %s' % (line_number, field, '; '.join(messages)), err=True)
+    click.echo('%d %s imported, %d rejected' % (inserted, kind, len(errors)))
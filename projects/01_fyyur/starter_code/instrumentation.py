@@ -0,0 +1,90 @@
+import time
+from collections import Counter, deque
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+
+class QueryRecorder(object):
+    # Counts and times every SQL statement run while handling a request.
+    # Statements are already parameterized, so identical text means identical
+    # shape; one shape repeated more than n_plus_one_threshold times in a
+    # single request is almost always a query issued inside a loop.
+
+    def __init__(self):
+        self.n_plus_one_threshold = 5
+        self.history = deque(maxlen=100)
+
+    def init_app(self, app, db):
+        self.app = app
+        self.n_plus_one_threshold = app.config.get('N_PLUS_ONE_THRESHOLD', 5)
+        self.history = deque(maxlen=app.config.get('QUERY_HISTORY_SIZE', 100))
+        # the read replicas are binds of their own; their engines are only
+        # reachable through get_engine
+        binds = [None] + list(app.config.get('SQLALCHEMY_BINDS') or ())
+        with app.app_context():
+            engines = [db.get_engine(app, bind=bind) for bind in binds]
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', self.after_cursor_execute)
+            event.listen(engine, 'handle_error', self.handle_error)
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+
+    def start_request(self):
+        g.query_stats = {'count': 0, 'seconds': 0.0, 'shapes': Counter()}
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append((context, time.perf_counter()))
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_started'].pop()[1]
+        stats = g.get('query_stats') if has_request_context() else None
+        if stats is None:
+            return
+        stats['count'] += 1
+        stats['seconds'] += elapsed
+        stats['shapes'][' '.join(statement.split())] += 1
+
+    def handle_error(self, exception_context):
+        # a failed statement never reaches after_cursor_execute; drop its
+        # start time so it does not linger on the pooled connection. Errors
+        # raised before the statement was sent have nothing to drop.
+        conn = exception_context.connection
+        started = conn.info.get('query_started') if conn is not None else None
+        if started and started[-1][0] is exception_context.execution_context:
+            started.pop()
+
+    def finish_request(self, response):
+        stats = g.get('query_stats')
+        if stats is None:
+            return response
+        # a streamed body runs its queries after this hook, while it is
+        # iterated, so the totals are only final once the response closes
+        method, path, status = request.method, request.path, response.status_code
+        response.call_on_close(lambda: self.record(stats, method, path, status))
+        return response
+
+    def record(self, stats, method, path, status):
+        repeated = [(shape, count) for shape, count in stats['shapes'].most_common()
+                    if count > self.n_plus_one_threshold]
+        record = {
+            'method': method,
+            'path': path,
+            'status': status,
+            'statements': stats['count'],
+            'db_ms': round(stats['seconds'] * 1000, 2),
+            'n_plus_one': [{'statement': shape, 'count': count} for shape, count in repeated],
+        }
+        self.history.append(record)
+        self.app.logger.info('queries method=%s path=%s status=%d statements=%d db_ms=%.2f',
+                             record['method'], record['path'], record['status'],
+                             record['statements'], record['db_ms'])
+        for shape, count in repeated:
+            self.app.logger.warning('n_plus_one method=%s path=%s count=%d statement="%s"',
+                                    record['method'], record['path'], count, shape[:300])
+
+    def recent(self):
+        return list(self.history)
+
+
+query_recorder = QueryRecorder()
@@ -0,0 +1,64 @@
+from bisect import bisect_left, bisect_right
+from threading import Lock
+
+
+class Timeline(object):
+    # Half-open [start, end) intervals sorted by start, with reach[i] holding
+    # the latest end among the first i + 1 of them. Every interval starting
+    # before `end` sits left of bisect(starts, end), and one of them overlaps
+    # [start, end) exactly when the reach at that position is past `start`,
+    # so a lookup is one bisect whatever the length of the history.
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.reach = []
+
+    def add(self, start, end):
+        position = bisect_right(self.starts, start)
+        self.starts.insert(position, start)
+        self.ends.insert(position, end)
+        self.reach.insert(position, end)
+        # bookings are mostly appended at the end of a timeline, where this
+        # touches only the new entry
+        for index in range(position, len(self.reach)):
+            self.reach[index] = max(self.reach[index - 1], self.ends[index]) if index else self.ends[index]
+
+    def overlaps(self, start, end):
+        position = bisect_left(self.starts, end)
+        return position > 0 and self.reach[position - 1] > start
+
+
+class IntervalIndex(object):
+    # One Timeline per key, e.g. ('venue', 3). Until load() has run, add() is
+    # a no-op because load() will read those rows from the database anyway.
+
+    def __init__(self):
+        self.timelines = {}
+        self.loaded = False
+        self.lock = Lock()
+
+    def load(self, rows):
+        with self.lock:
+            self.timelines = {}
+            # in start order every add() is an append
+            for key, start, end in sorted(rows, key=lambda row: row[1]):
+                self.timelines.setdefault(key, Timeline()).add(start, end)
+            self.loaded = True
+
+    def add(self, key, start, end):
+        with self.lock:
+            if self.loaded:
+                self.timelines.setdefault(key, Timeline()).add(start, end)
+
+    def discard(self, key):
+        with self.lock:
+            self.timelines.pop(key, None)
+
+    def overlaps(self, key, start, end):
+        with self.lock:
+            timeline = self.timelines.get(key)
+            return timeline is not None and timeline.overlaps(start, end)
+
+
+booking_index = IntervalIndex()
@@ -0,0 +1,80 @@
+import heapq
+from collections import Counter
+from threading import Lock
+
+OTHER_KIND = {'venue': 'artist', 'artist': 'venue'}
+
+
+class MatchIndex(object):
+    # Inverted index from (kind, state, city, genre) to the ids of venues
+    # seeking talent and artists seeking venues there. Matching is one set
+    # lookup per genre of the venue or artist asking; the number of those
+    # sets an id turns up in is its genre overlap, which ranks the matches.
+
+    def __init__(self):
+        self.postings = {}
+        self.entries = {}
+        self.lock = Lock()
+
+    def load(self, kind, rows):
+        # rows of (id, name, state, city, genres), only the seeking ones
+        with self.lock:
+            for id, name, state, city, genres in rows:
+                self._remove(kind, id)
+                self._add(kind, id, name, state, city, genres)
+
+    def add(self, kind, id, name, state, city, genres, seeking):
+        # returns the ids on the other side whose matches this changed
+        with self.lock:
+            affected = self._remove(kind, id)
+            if seeking:
+                affected |= self._add(kind, id, name, state, city, genres)
+            return affected
+
+    def remove(self, kind, id):
+        with self.lock:
+            return self._remove(kind, id)
+
+    def matches(self, kind, state, city, genres, limit=6):
+        # the other side in the same city sharing a genre, most shared
+        # genres first, then by name
+        other = OTHER_KIND[kind]
+        genres = set(genres or ())
+        with self.lock:
+            overlap = Counter()
+            for genre in genres:
+                overlap.update(self.postings.get((other, state, city, genre), ()))
+            best = heapq.nsmallest(limit, overlap.items(), key=lambda item: (
+                -item[1], self.entries[(other, item[0])][0].lower(), item[0]))
+            return [{
+                'id': id,
+                'name': self.entries[(other, id)][0],
+                'shared_genres': sorted(genres & self.entries[(other, id)][3])
+            } for id, count in best]
+
+    def _add(self, kind, id, name, state, city, genres):
+        genres = frozenset(genres or ())
+        self.entries[(kind, id)] = (name or '', state, city, genres)
+        for genre in genres:
+            self.postings.setdefault((kind, state, city, genre), set()).add(id)
+        return self._neighbours(kind, state, city, genres)
+
+    def _remove(self, kind, id):
+        entry = self.entries.pop((kind, id), None)
+        if entry is None:
+            return set()
+        name, state, city, genres = entry
+        for genre in genres:
+            ids = self.postings.get((kind, state, city, genre))
+            if ids is not None:
+                ids.discard(id)
+                if not ids:
+                    del self.postings[(kind, state, city, genre)]
+        return self._neighbours(kind, state, city, genres)
+
+    def _neighbours(self, kind, state, city, genres):
+        other = OTHER_KIND[kind]
+        return set().union(*[self.postings.get((other, state, city, genre), ()) for genre in genres])
+
+
+match_index = MatchIndex()
@@ -0,0 +1,39 @@
+"""show end times and double-booking exclusion constraints
+
+Revision ID: 3148b9de0e54
+Revises: 6440e99aaaa4
+Create Date: 2026-10-18 14:31:27.604118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3148b9de0e54'
+down_revision = '6440e99aaaa4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('Show', sa.Column('end_time', sa.DateTime(), nullable=True))
+    # existing shows get the default two-hour slot
+    op.execute('''UPDATE "Show" SET end_time = start_time + INTERVAL '2 hours' ''')
+    op.alter_column('Show', 'end_time', nullable=False)
+    op.create_check_constraint('ck_Show_end_after_start', 'Show', 'end_time > start_time')
+    # fails if the existing data already holds double bookings; those have
+    # to be resolved by hand before upgrading
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    for constraint, column in (('ex_Show_venue_id_during', 'venue_id'), ('ex_Show_artist_id_during', 'artist_id')):
+        op.execute(
+            'ALTER TABLE "Show" ADD CONSTRAINT "%s" EXCLUDE USING gist '
+            '(%s WITH =, tsrange(start_time, end_time) WITH &&)' % (constraint, column)
+        )
+
+
+def downgrade():
+    op.drop_constraint('ex_Show_artist_id_during', 'Show')
+    op.drop_constraint('ex_Show_venue_id_during', 'Show')
+    op.drop_constraint('ck_Show_end_after_start', 'Show')
+    op.drop_column('Show', 'end_time')
@@ -0,0 +1,32 @@
+"""indexes for faceted browse by genre, location and seeking flags
+
+Revision ID: 6440e99aaaa4
+Revises: e8c1f0b6a2d4
+Create Date: 2026-10-18 13:48:09.118254
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6440e99aaaa4'
+down_revision = 'e8c1f0b6a2d4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_Venue_genres', 'Venue', ['genres'], unique=False, postgresql_using='gin')
+    op.create_index('ix_Venue_seeking_talent_state_city', 'Venue', ['seeking_talent', 'state', 'city'], unique=False)
+    op.create_index('ix_Artist_genres', 'Artist', ['genres'], unique=False, postgresql_using='gin')
+    op.create_index('ix_Artist_state_city', 'Artist', ['state', 'city'], unique=False)
+    op.create_index('ix_Artist_seeking_venue_state_city', 'Artist', ['seeking_venue', 'state', 'city'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Artist_seeking_venue_state_city', table_name='Artist')
+    op.drop_index('ix_Artist_state_city', table_name='Artist')
+    op.drop_index('ix_Artist_genres', table_name='Artist')
+    op.drop_index('ix_Venue_seeking_talent_state_city', table_name='Venue')
+    op.drop_index('ix_Venue_genres', table_name='Venue')
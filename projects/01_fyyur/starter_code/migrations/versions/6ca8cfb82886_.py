@@ -0,0 +1,46 @@
+"""maintained upcoming and past show counts per venue and artist
+
+Revision ID: 6ca8cfb82886
+Revises: 6182bab65a31
+Create Date: 2026-10-18 12:20:53.514307
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6ca8cfb82886'
+down_revision = '6182bab65a31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('ShowCount',
+    sa.Column('kind', sa.String(length=10), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=False),
+    sa.Column('upcoming_shows', sa.Integer(), nullable=False),
+    sa.Column('past_shows', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('kind', 'entity_id')
+    )
+    op.create_table('ShowCountRollover',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('rolled_until', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    # backfill from the existing shows, split at the migration time
+    for kind, column in (('venue', 'venue_id'), ('artist', 'artist_id')):
+        op.execute(
+            'INSERT INTO "ShowCount" (kind, entity_id, upcoming_shows, past_shows) '
+            "SELECT '{kind}', {column}, "
+            'SUM(CASE WHEN start_time > LOCALTIMESTAMP THEN 1 ELSE 0 END), '
+            'SUM(CASE WHEN start_time <= LOCALTIMESTAMP THEN 1 ELSE 0 END) '
+            'FROM "Show" WHERE {column} IS NOT NULL GROUP BY {column}'.format(kind=kind, column=column)
+        )
+    op.execute('INSERT INTO "ShowCountRollover" (id, rolled_until) VALUES (1, LOCALTIMESTAMP)')
+
+
+def downgrade():
+    op.drop_table('ShowCountRollover')
+    op.drop_table('ShowCount')
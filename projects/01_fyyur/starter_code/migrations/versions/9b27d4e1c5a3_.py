@@ -0,0 +1,28 @@
+"""updated_at on venues, artists and shows
+
+Revision ID: 9b27d4e1c5a3
+Revises: 3148b9de0e54
+Create Date: 2026-10-18 15:02:44.187342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b27d4e1c5a3'
+down_revision = '3148b9de0e54'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('Venue', 'Artist', 'Show'):
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=True))
+        op.execute('UPDATE "%s" SET updated_at = LOCALTIMESTAMP' % table)
+        op.alter_column(table, 'updated_at', nullable=False)
+
+
+def downgrade():
+    for table in ('Show', 'Artist', 'Venue'):
+        op.drop_column(table, 'updated_at')
@@ -0,0 +1,28 @@
+"""indexes for keyset pagination of the venue and artist directories
+
+Revision ID: e8c1f0b6a2d4
+Revises: 6ca8cfb82886
+Create Date: 2026-10-18 13:05:31.772406
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8c1f0b6a2d4'
+down_revision = '6ca8cfb82886'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_Venue_state_city_id', 'Venue', ['state', 'city', 'id'], unique=False)
+    op.create_index('ix_Venue_name_id', 'Venue', ['name', 'id'], unique=False)
+    op.create_index('ix_Artist_name_id', 'Artist', ['name', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Artist_name_id', table_name='Artist')
+    op.drop_index('ix_Venue_name_id', table_name='Venue')
+    op.drop_index('ix_Venue_state_city_id', table_name='Venue')
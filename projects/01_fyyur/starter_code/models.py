@@ -1,12 +1,23 @@
-from sqlalchemy import Column, String, Integer, Boolean, DateTime, ARRAY, ForeignKey
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import Column, String, Integer, Boolean, DateTime, ARRAY, JSON, ForeignKey, Index, CheckConstraint, DDL, event
+from sqlalchemy.exc import IntegrityError
 from flask_migrate import Migrate
+from collections import Counter
+from contextlib import contextmanager
 from datetime import *
-db = SQLAlchemy()
+import dateutil.parser
+from dateutil.rrule import rrule, WEEKLY, MONTHLY
+from itertools import islice
+from autocomplete import name_index
+from matchmaking import match_index
+from cache import page_cache
+from intervals import Timeline, booking_index
+from routing import RoutingSQLAlchemy, replica_router
+db = RoutingSQLAlchemy()
 
 def setup_db(app):
     db.app = app
     db.init_app(app)
+    replica_router.init_app(app, db)
     app.config.from_object('config')
     migrate = Migrate(app, db)
 
@@ -19,10 +30,20 @@ def setup_db(app):
 
 class Venue(db.Model):
     __tablename__ = 'Venue'
+    __table_args__ = (
+        Index('ix_Venue_name_trgm', 'name',
+              postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        # keyset pagination of the directory and of search results
+        Index('ix_Venue_state_city_id', 'state', 'city', 'id'),
+        Index('ix_Venue_name_id', 'name', 'id'),
+        # faceted browse
+        Index('ix_Venue_genres', 'genres', postgresql_using='gin'),
+        Index('ix_Venue_seeking_talent_state_city', 'seeking_talent', 'state', 'city'),
+    )
 
     id = Column(Integer, primary_key=True)
     name = Column(String)
-    genres = Column(ARRAY(String))
+    genres = Column(ARRAY(String).with_variant(JSON, 'sqlite'))
     address = Column(String(120))
     city = Column(String(120))
     state = Column(String(120))
@@ -33,6 +54,7 @@ class Venue(db.Model):
     seeking_talent = Column(Boolean)
     seeking_description = Column(String(500))
     image_link = Column(String(500))
+    updated_at = Column(DateTime, nullable=False, default=datetime.now)
     shows = db.relationship('Show', backref='Venue', lazy='dynamic')
 
     def __init__(self, name, genres, address, city, state, phone, website, facebook_link, image_link,
@@ -50,15 +72,40 @@ class Venue(db.Model):
         self.image_link = image_link
 
     def insert(self):
+        self.updated_at = datetime.now()
         db.session.add(self)
         db.session.commit()
+        name_index.add('venues', self.id, self.name)
+        page_cache.invalidate('venues', 'facets:venues', 'venue:%d' % self.id, *self.match_tags())
 
     def update(self):
+        self.updated_at = datetime.now()
         db.session.commit()
+        name_index.add('venues', self.id, self.name)
+        page_cache.invalidate(*self.cache_tags() + self.match_tags())
 
     def delete(self):
+        venue_id = self.id
+        cache_tags = self.cache_tags()
         db.session.delete(self)
+        ShowCount.query.filter_by(kind='venue', entity_id=venue_id).delete()
         db.session.commit()
+        name_index.remove('venues', venue_id)
+        booking_index.discard(('venue', venue_id))
+        page_cache.invalidate(*cache_tags + ['artist:%d' % artist_id for artist_id in match_index.remove('venue', venue_id)])
+
+    def cache_tags(self):
+        # the venue name and image also appear on /shows and on the pages of
+        # every artist that played here
+        artist_ids = self.shows.with_entities(Show.artist_id).distinct()
+        return ['venues', 'facets:venues', 'shows', 'venue:%d' % self.id] + \
+            ['artist:%d' % artist_id for (artist_id,) in artist_ids]
+
+    def match_tags(self):
+        # re-indexes the venue and returns the pages of the artists whose
+        # matches that changed
+        affected = match_index.add('venue', self.id, self.name, self.state, self.city, self.genres, self.seeking_talent)
+        return ['artist:%d' % artist_id for artist_id in affected]
 
     def short(self):
         return {
@@ -95,10 +142,19 @@ class Venue(db.Model):
 
 class Artist(db.Model):
     __tablename__ = 'Artist'
+    __table_args__ = (
+        Index('ix_Artist_name_trgm', 'name',
+              postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        Index('ix_Artist_name_id', 'name', 'id'),
+        # faceted browse
+        Index('ix_Artist_genres', 'genres', postgresql_using='gin'),
+        Index('ix_Artist_state_city', 'state', 'city'),
+        Index('ix_Artist_seeking_venue_state_city', 'seeking_venue', 'state', 'city'),
+    )
 
     id = Column(Integer, primary_key=True)
     name = Column(String)
-    genres = Column(ARRAY(String))
+    genres = Column(ARRAY(String).with_variant(JSON, 'sqlite'))
     city = Column(String(120))
     state = Column(String(120))
     phone = Column(String(120))
@@ -107,6 +163,7 @@ class Artist(db.Model):
     seeking_venue =  Column(Boolean)
     seeking_description =  Column(String(500))
     image_link = Column(String(500))
+    updated_at = Column(DateTime, nullable=False, default=datetime.now)
     shows = db.relationship('Show', backref='Artist', lazy='dynamic')
 
     def __init__(self, name, genres, city, state, phone, website, facebook_link, image_link,
@@ -123,11 +180,26 @@ class Artist(db.Model):
         self.image_link = image_link
 
     def insert(self):
+        self.updated_at = datetime.now()
         db.session.add(self)
         db.session.commit()
+        name_index.add('artists', self.id, self.name)
+        page_cache.invalidate('artists', 'facets:artists', 'artist:%d' % self.id, *self.match_tags())
 
     def update(self):
+        self.updated_at = datetime.now()
         db.session.commit()
+        name_index.add('artists', self.id, self.name)
+        page_cache.invalidate(*self.cache_tags() + self.match_tags())
+
+    def cache_tags(self):
+        venue_ids = self.shows.with_entities(Show.venue_id).distinct()
+        return ['artists', 'facets:artists', 'shows', 'artist:%d' % self.id] + \
+            ['venue:%d' % venue_id for (venue_id,) in venue_ids]
+
+    def match_tags(self):
+        affected = match_index.add('artist', self.id, self.name, self.state, self.city, self.genres, self.seeking_venue)
+        return ['venue:%d' % venue_id for venue_id in affected]
 
     def short(self):
         return {
@@ -154,20 +226,52 @@ class Artist(db.Model):
 
 class Show(db.Model):
     __tablename__ = 'Show'
+    __table_args__ = (
+        # detail pages filter on (venue_id | artist_id, start_time)
+        Index('ix_Show_venue_id_start_time', 'venue_id', 'start_time'),
+        Index('ix_Show_artist_id_start_time', 'artist_id', 'start_time'),
+        # "upcoming" range scans and the /shows keyset order
+        Index('ix_Show_start_time_id', 'start_time', 'id'),
+        CheckConstraint('end_time > start_time', name='ck_Show_end_after_start'),
+    )
 
     id = Column(Integer, primary_key=True)
     venue_id = Column(Integer, ForeignKey('Venue.id'))
     artist_id = Column(Integer, ForeignKey('Artist.id'))
     start_time = Column(DateTime, nullable=False)
+    end_time = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False, default=datetime.now)
 
-    def __init__(self, venue_id, artist_id, start_time):
+    def __init__(self, venue_id, artist_id, start_time, end_time=None):
         self.venue_id = venue_id
         self.artist_id = artist_id
-        self.start_time = start_time
+        self.start_time = parse_start_time(start_time)
+        self.end_time = parse_start_time(end_time) if end_time else self.start_time + DEFAULT_SHOW_DURATION
+        if self.end_time <= self.start_time:
+            raise ValueError('A show has to end after it starts.')
 
     def insert(self):
-        db.session.add(self)
-        db.session.commit()
+        check_bookings([self])
+        self.updated_at = datetime.now()
+        with booking_write([self]):
+            db.session.add(self)
+            count_shows([(self.venue_id, self.artist_id, self.start_time)])
+            touch_parents([(self.venue_id, self.artist_id)])
+
+    @staticmethod
+    def insert_many(shows):
+        # a whole series goes in as one multi-row INSERT and one transaction;
+        # if any date is taken, none of them are listed
+        check_bookings(shows)
+        with booking_write(shows):
+            db.session.execute(Show.__table__.insert().values([{
+                'venue_id': show.venue_id,
+                'artist_id': show.artist_id,
+                'start_time': show.start_time,
+                'end_time': show.end_time,
+            } for show in shows]))
+            count_shows([(show.venue_id, show.artist_id, show.start_time) for show in shows])
+            touch_parents([(show.venue_id, show.artist_id) for show in shows])
 
     def details(self):
         return {
@@ -176,7 +280,7 @@ class Show(db.Model):
             'artist_id': self.artist_id,
             'artist_name': self.Artist.name,
             'artist_image_link': self.Artist.image_link,
-            'start_time': self.start_time.strftime('%Y-%m-%dT%H:%M:%SZ')
+            'start_time': self.start_time
         }
 
     def artist_details(self):
@@ -184,7 +288,7 @@ class Show(db.Model):
             'artist_id': self.artist_id,
             'artist_name': self.Artist.name,
             'artist_image_link': self.Artist.image_link,
-            'start_time': self.start_time.strftime('%Y-%m-%dT%H:%M:%SZ')
+            'start_time': self.start_time
         }
 
     def venue_details(self):
@@ -192,9 +296,235 @@ class Show(db.Model):
             'venue_id': self.venue_id,
             'venue_name': self.Venue.name,
             'venue_image_link': self.Venue.image_link,
-            'start_time': self.start_time.strftime('%Y-%m-%dT%H:%M:%SZ')
+            'start_time': self.start_time
         }
 
+DEFAULT_SHOW_DURATION = timedelta(hours=2)
+
+# a venue or an artist cannot be booked for two overlapping shows; Postgres
+# enforces it with GiST exclusion constraints (btree_gist supplies the
+# equality operator class for the id columns)
+BOOKING_CONSTRAINTS = {'ex_Show_venue_id_during': 'venue', 'ex_Show_artist_id_during': 'artist'}
+
+event.listen(Show.__table__, 'before_create',
+             DDL('CREATE EXTENSION IF NOT EXISTS btree_gist').execute_if(dialect='postgresql'))
+for constraint, column in (('ex_Show_venue_id_during', 'venue_id'), ('ex_Show_artist_id_during', 'artist_id')):
+    event.listen(Show.__table__, 'after_create', DDL(
+        'ALTER TABLE "Show" ADD CONSTRAINT "%s" EXCLUDE USING gist '
+        '(%s WITH =, tsrange(start_time, end_time) WITH &&)' % (constraint, column)
+    ).execute_if(dialect='postgresql'))
+
+
+class BookingConflict(Exception):
+    def __init__(self, kind):
+        super(BookingConflict, self).__init__('The %s is already booked at that time.' % kind)
+        self.kind = kind
+
+
+def booking_conflict(venue_id, artist_id, start_time, end_time):
+    # returns 'venue' or 'artist' when either already has a show overlapping
+    # [start_time, end_time). Postgres rejects those rows at INSERT through
+    # the exclusion constraints; other databases (SQLite in development and
+    # tests) are checked against the in-process booking_index, which only
+    # sees shows written through this process.
+    if db.engine.dialect.name == 'postgresql':
+        return None
+    if not booking_index.loaded:
+        load_booking_index()
+    for kind, entity_id in (('venue', venue_id), ('artist', artist_id)):
+        if booking_index.overlaps((kind, int(entity_id)), start_time, end_time):
+            return kind
+    return None
+
+
+def check_bookings(shows):
+    # against existing shows and against each other
+    pending = {}
+    for show in shows:
+        keys = (('venue', int(show.venue_id)), ('artist', int(show.artist_id)))
+        conflict = booking_conflict(show.venue_id, show.artist_id, show.start_time, show.end_time)
+        for kind, entity_id in keys:
+            if conflict is None and (kind, entity_id) in pending and \
+                    pending[(kind, entity_id)].overlaps(show.start_time, show.end_time):
+                conflict = kind
+        if conflict:
+            raise BookingConflict(conflict)
+        for key in keys:
+            pending.setdefault(key, Timeline()).add(show.start_time, show.end_time)
+
+
+@contextmanager
+def booking_write(shows):
+    # wraps every statement that writes the shows, then commits. On Postgres
+    # an exclusion constraint fails whichever statement writes the row first
+    # (a Core INSERT, or the autoflush before the counter queries), so all
+    # of them have to be inside the try that maps it to a BookingConflict
+    try:
+        yield
+        db.session.commit()
+    except IntegrityError as error:
+        db.session.rollback()
+        constraint = getattr(getattr(error.orig, 'diag', None), 'constraint_name', None)
+        if constraint in BOOKING_CONSTRAINTS:
+            raise BookingConflict(BOOKING_CONSTRAINTS[constraint])
+        raise
+    cache_tags = set(['shows', 'venues'])
+    for show in shows:
+        booking_index.add(('venue', int(show.venue_id)), show.start_time, show.end_time)
+        booking_index.add(('artist', int(show.artist_id)), show.start_time, show.end_time)
+        cache_tags.update(('venue:%s' % show.venue_id, 'artist:%s' % show.artist_id))
+    # /venues carries upcoming show counts, /artists does not
+    page_cache.invalidate(*cache_tags)
+
+
+def load_booking_index():
+    # conflicts are checked against this, so it is read from the primary
+    rows = db.session.execute(
+        db.select([Show.venue_id, Show.artist_id, Show.start_time, Show.end_time]), bind=db.engine)
+    booking_index.load(
+        ((kind, entity_id), start_time, end_time)
+        for venue_id, artist_id, start_time, end_time in rows
+        for kind, entity_id in (('venue', venue_id), ('artist', artist_id))
+        if entity_id is not None
+    )
+
+
+SERIES_FREQUENCIES = {'weekly': WEEKLY, 'monthly': MONTHLY}
+
+
+def show_series(start_time, repeat=None, count=None, until=None, limit=100):
+    # start times of a show and its repeats; `count` includes the first show
+    # and `until` is an inclusive date. Monthly series skip months that have
+    # no such day, as iCalendar does.
+    start_time = parse_start_time(start_time)
+    if not repeat:
+        return [start_time]
+    if repeat not in SERIES_FREQUENCIES:
+        raise ValueError('Unknown repeat rule %r.' % repeat)
+    if count:
+        rule = rrule(SERIES_FREQUENCIES[repeat], dtstart=start_time, count=int(count))
+    elif until:
+        if isinstance(until, str):
+            until = parse_start_time(until)
+        # a datetime's own time is dropped, the whole day counts
+        until = datetime.combine(until, time.max)
+        rule = rrule(SERIES_FREQUENCIES[repeat], dtstart=start_time, until=until)
+    else:
+        raise ValueError('A repeating show needs a count or an end date.')
+    start_times = list(islice(rule, limit + 1))
+    if len(start_times) > limit:
+        raise ValueError('A series can have at most %d shows.' % limit)
+    return start_times
+
+
+def parse_start_time(value):
+    # start_time column is timezone-naive; '2035-04-01T20:00:00.000Z' style
+    # strings keep their wall-clock time, as a Postgres cast would
+    if isinstance(value, str):
+        value = dateutil.parser.parse(value)
+    if value.tzinfo is not None:
+        value = value.replace(tzinfo=None)
+    return value
+
+
+#----------------------------------------------------------------------------#
+# Show counts.
+#----------------------------------------------------------------------------#
+
+class ShowCount(db.Model):
+    # Maintained per-venue and per-artist show counts. "Upcoming" is relative
+    # to ShowCountRollover.rolled_until rather than now(); the roll-over
+    # command moves shows that have since started from upcoming to past.
+    __tablename__ = 'ShowCount'
+
+    kind = Column(String(10), primary_key=True)
+    entity_id = Column(Integer, primary_key=True)
+    upcoming_shows = Column(Integer, nullable=False, default=0)
+    past_shows = Column(Integer, nullable=False, default=0)
+
+
+class ShowCountRollover(db.Model):
+    __tablename__ = 'ShowCountRollover'
+
+    id = Column(Integer, primary_key=True)
+    rolled_until = Column(DateTime, nullable=False)
+
+
+def count_shows(shows):
+    # adds (venue_id, artist_id, start_time) rows to the counters inside the
+    # caller's transaction
+    rollover = ShowCountRollover.query.get(1)
+    if rollover is None:
+        db.session.flush()
+        rebuild_show_counts()
+        return
+    deltas = Counter()
+    for venue_id, artist_id, start_time in shows:
+        column = 'upcoming_shows' if start_time > rollover.rolled_until else 'past_shows'
+        deltas[('venue', int(venue_id), column)] += 1
+        deltas[('artist', int(artist_id), column)] += 1
+    for (kind, entity_id, column), delta in deltas.items():
+        updated = ShowCount.query.filter_by(kind=kind, entity_id=entity_id) \
+            .update({column: getattr(ShowCount, column) + delta}, synchronize_session=False)
+        if not updated:
+            counts = {'upcoming_shows': 0, 'past_shows': 0}
+            counts[column] = delta
+            db.session.add(ShowCount(kind=kind, entity_id=entity_id, **counts))
+
+
+def touch_parents(pairs):
+    # a new show changes its venue's and its artist's pages, so it moves
+    # their updated_at, which the pages' ETag and Last-Modified come from
+    now = datetime.now()
+    venue_ids = set(int(venue_id) for venue_id, artist_id in pairs)
+    artist_ids = set(int(artist_id) for venue_id, artist_id in pairs)
+    Venue.query.filter(Venue.id.in_(venue_ids)).update({'updated_at': now}, synchronize_session=False)
+    Artist.query.filter(Artist.id.in_(artist_ids)).update({'updated_at': now}, synchronize_session=False)
+
+
+def rebuild_show_counts(now=None):
+    # full recount from Show; used to initialise the counters and to repair them
+    now = now or datetime.now()
+    ShowCount.query.delete(synchronize_session=False)
+    for kind, column in (('venue', Show.venue_id), ('artist', Show.artist_id)):
+        counts = db.session.query(
+            column,
+            db.func.sum(db.case([(Show.start_time > now, 1)], else_=0)),
+            db.func.sum(db.case([(Show.start_time <= now, 1)], else_=0))
+        ).filter(column.isnot(None)).group_by(column)
+        db.session.bulk_insert_mappings(ShowCount, [{
+            'kind': kind,
+            'entity_id': entity_id,
+            'upcoming_shows': upcoming_shows,
+            'past_shows': past_shows,
+        } for entity_id, upcoming_shows, past_shows in counts])
+    rollover = ShowCountRollover.query.get(1) or ShowCountRollover(id=1)
+    rollover.rolled_until = now
+    db.session.add(rollover)
+
+
+def roll_over_show_counts(now=None):
+    # moves shows that started since the last roll-over from upcoming to past;
+    # reads only that window of Show through the start_time index
+    now = now or datetime.now()
+    rollover = ShowCountRollover.query.with_for_update().get(1)
+    if rollover is None:
+        rebuild_show_counts(now)
+        db.session.commit()
+        return
+    for kind, column in (('venue', Show.venue_id), ('artist', Show.artist_id)):
+        started = db.session.query(column, db.func.count(Show.id)) \
+            .filter(Show.start_time > rollover.rolled_until, Show.start_time <= now) \
+            .group_by(column)
+        for entity_id, count in started:
+            ShowCount.query.filter_by(kind=kind, entity_id=entity_id).update({
+                'upcoming_shows': ShowCount.upcoming_shows - count,
+                'past_shows': ShowCount.past_shows + count,
+            }, synchronize_session=False)
+    rollover.rolled_until = now
+    db.session.commit()
+
+
 def insert_venues():
     ven1 = Venue("The Musical Hop", ["Jazz", "Reggae", "Swing", "Classical", "Folk"], 
                  "1015 Folsom Street", "San Francisco", "CA", "123-123-1234", "https://www.themusicalhop.com", "https://www.facebook.com/TheMusicalHop",
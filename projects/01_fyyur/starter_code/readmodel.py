@@ -0,0 +1,341 @@
+import sys
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime
+from threading import RLock
+from sqlalchemy import event
+from sqlalchemy.sql.dml import Insert
+
+
+class VenueRecord(object):
+    FIELDS = ('id', 'name', 'genres', 'address', 'city', 'state', 'phone', 'website',
+              'facebook_link', 'seeking_talent', 'seeking_description', 'image_link')
+    __slots__ = FIELDS
+
+
+class ArtistRecord(object):
+    FIELDS = ('id', 'name', 'genres', 'city', 'state', 'phone', 'website',
+              'facebook_link', 'seeking_venue', 'seeking_description', 'image_link')
+    __slots__ = FIELDS
+
+
+class ShowRecord(object):
+    # Venue and Artist point at the live records, so the Show serializers in
+    # models.py work on a ShowRecord unchanged
+    FIELDS = ('id', 'venue_id', 'artist_id', 'start_time', 'end_time')
+    __slots__ = FIELDS + ('Venue', 'Artist')
+
+
+RECORDS = {'Venue': VenueRecord, 'Artist': ArtistRecord, 'Show': ShowRecord}
+
+
+def text_key(value):
+    return value or ''
+
+
+class ReadModel(object):
+    # Venues, artists and shows held in memory so GET routes can be served
+    # without a database round trip. Indexes are sorted lists of key tuples
+    # ending in the id, searched with bisect:
+    #   venues_by_area  (state, city, id)     /venues
+    #   venues_by_name  (lower(name), id)     /venues/search
+    #   artists_by_name (lower(name), id)     /artists, /artists/search
+    #   shows_by_start  (start_time, id)      /shows
+    #   shows_by_venue / shows_by_artist      {id: [(start_time, show id)]}
+    # Writes made through the ORM are snapshotted after each flush and
+    # applied after the commit; multi-row Core INSERTs (series, imports) are
+    # picked up by id on the next read. Only writes made by this process are
+    # seen, so it suits a single worker; `flask read-model check` and
+    # /__debug/read-model report any drift from the database.
+
+    def __init__(self):
+        self.lock = RLock()
+        self.loaded = False
+        self.db = None
+        self.inserted_tables = set()
+        self.stale_tables = set()
+        # bumped by every record change and never reset, so a reload cannot
+        # hand out an ETag from before it
+        self.version = 0
+        self.clear()
+
+    def clear(self):
+        self.changed_at = None
+        self.records = {'Venue': {}, 'Artist': {}, 'Show': {}}
+        self.caught_up_id = {'Venue': 0, 'Artist': 0, 'Show': 0}
+        self.venues_by_area = []
+        self.venues_by_name = []
+        self.artists_by_name = []
+        self.shows_by_start = []
+        self.shows_by_venue = {}
+        self.shows_by_artist = {}
+
+    def init_app(self, app, db):
+        self.db = db
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, 'after_execute', self.after_execute)
+        event.listen(db.session, 'after_flush', self.after_flush)
+        event.listen(db.session, 'after_commit', self.after_commit)
+        event.listen(db.session, 'after_rollback', self.after_rollback)
+
+    def load(self):
+        with self.lock:
+            self.clear()
+            for table in ('Venue', 'Artist', 'Show'):
+                self._read_rows(table, 0)
+            self.stale_tables.clear()
+            self.loaded = True
+
+    # Sync
+
+    def after_flush(self, session, flush_context):
+        if not self.loaded:
+            return
+        changes = session.info.setdefault('read_model_changes', [])
+        for instance in list(session.new) + list(session.dirty):
+            table = getattr(instance, '__tablename__', None)
+            if table in RECORDS:
+                changes.append((table, instance.id, self._values(table, instance)))
+        for instance in session.deleted:
+            table = getattr(instance, '__tablename__', None)
+            if table in RECORDS:
+                changes.append((table, instance.id, None))
+
+    def after_commit(self, session):
+        changes = session.info.pop('read_model_changes', [])
+        with self.lock:
+            self.stale_tables |= self.inserted_tables
+            self.inserted_tables.clear()
+            if not self.loaded:
+                return
+            for table, id, values in changes:
+                if values is None:
+                    self._remove(table, id)
+                else:
+                    self._upsert(table, values)
+
+    def after_rollback(self, session):
+        session.info.pop('read_model_changes', None)
+        with self.lock:
+            self.inserted_tables.clear()
+
+    def after_execute(self, conn, clauseelement, multiparams, params, *args):
+        if isinstance(clauseelement, Insert) and clauseelement.table.name in RECORDS:
+            with self.lock:
+                self.inserted_tables.add(clauseelement.table.name)
+
+    def catch_up(self):
+        # Core INSERTs bypass the session events; read whatever they added
+        with self.lock:
+            for table in ('Venue', 'Artist', 'Show'):
+                if table in self.stale_tables:
+                    self.stale_tables.discard(table)
+                    self._read_rows(table, self.caught_up_id[table])
+
+    # Reads
+
+    def venue(self, id):
+        with self.lock:
+            self.catch_up()
+            return self.records['Venue'].get(id)
+
+    def artist(self, id):
+        with self.lock:
+            self.catch_up()
+            return self.records['Artist'].get(id)
+
+    def many(self, table, ids):
+        with self.lock:
+            return [self.records[table][id] for id in ids]
+
+    def index(self, name):
+        # a copy, so callers can slice it without holding the lock
+        with self.lock:
+            self.catch_up()
+            return list(getattr(self, name))
+
+    def name_matches(self, name, search_term):
+        term = search_term.lower()
+        with self.lock:
+            self.catch_up()
+            return [entry for entry in getattr(self, name) if term in entry[0]]
+
+    def venue_shows(self, venue_id):
+        with self.lock:
+            self.catch_up()
+            return [self.records['Show'][id] for start_time, id in self.shows_by_venue.get(venue_id, [])]
+
+    def artist_shows(self, artist_id):
+        with self.lock:
+            self.catch_up()
+            return [self.records['Show'][id] for start_time, id in self.shows_by_artist.get(artist_id, [])]
+
+    def venue_shows_between(self, venue_id, start, end):
+        # shows starting in [start, end); (start,) sorts before every (start, id)
+        with self.lock:
+            self.catch_up()
+            shows = self.shows_by_venue.get(venue_id, [])
+            keys = shows[bisect_left(shows, (start,)):bisect_left(shows, (end,))]
+            return [self.records['Show'][id] for start_time, id in keys]
+
+    def city_shows_between(self, state, city, start, end):
+        with self.lock:
+            self.catch_up()
+            low = bisect_left(self.venues_by_area, (state, city))
+            high = bisect_right(self.venues_by_area, (state, city, sys.maxsize))
+            keys = []
+            for venue_state, venue_city, venue_id in self.venues_by_area[low:high]:
+                shows = self.shows_by_venue.get(venue_id, [])
+                keys.extend(shows[bisect_left(shows, (start,)):bisect_left(shows, (end,))])
+            return [self.records['Show'][id] for start_time, id in sorted(keys)]
+
+    def validators(self, now):
+        # (last_modified, version) for cache.conditional, without a query: the
+        # change counter, and the latest show started by now, since shows move
+        # from upcoming to past without any write
+        with self.lock:
+            self.catch_up()
+            position = bisect_right(self.shows_by_start, (now, sys.maxsize))
+            started = self.shows_by_start[position - 1][0] if position else None
+            times = [value for value in (self.changed_at, started) if value is not None]
+            return max(times) if times else None, [self.version, started]
+
+    def upcoming_count(self, venue_id, now):
+        with self.lock:
+            shows = self.shows_by_venue.get(venue_id, [])
+            return len(shows) - bisect_right(shows, (now, sys.maxsize))
+
+    # Consistency and footprint
+
+    def check(self):
+        # compares every record and index with a fresh read of the database
+        fresh = ReadModel()
+        fresh.db = self.db
+        fresh.load()
+        problems = []
+        with self.lock:
+            self.catch_up()
+            for table, record_class in RECORDS.items():
+                ours, theirs = self.records[table], fresh.records[table]
+                for id in sorted(set(ours) | set(theirs)):
+                    if id not in theirs:
+                        problems.append('%s %d is not in the database' % (table, id))
+                    elif id not in ours:
+                        problems.append('%s %d is missing' % (table, id))
+                    else:
+                        for field in record_class.FIELDS:
+                            if getattr(ours[id], field) != getattr(theirs[id], field):
+                                problems.append('%s %d: %s differs' % (table, id, field))
+            for name in ('venues_by_area', 'venues_by_name', 'artists_by_name', 'shows_by_start',
+                         'shows_by_venue', 'shows_by_artist'):
+                if getattr(self, name) != getattr(fresh, name):
+                    problems.append('index %s differs' % name)
+        return problems
+
+    def memory_report(self):
+        def size(value):
+            total = sys.getsizeof(value)
+            if isinstance(value, (list, tuple)):
+                total += sum(size(item) for item in value)
+            elif isinstance(value, dict):
+                total += sum(size(key) + size(item) for key, item in value.items())
+            return total
+
+        with self.lock:
+            report = {}
+            for table, record_class in RECORDS.items():
+                records = self.records[table]
+                record_bytes = sys.getsizeof(records) + sum(
+                    sys.getsizeof(record) + sum(size(getattr(record, field)) for field in record_class.FIELDS)
+                    for record in records.values())
+                report[table] = {'records': len(records), 'bytes': record_bytes}
+            report['indexes'] = dict(
+                (name, size(getattr(self, name)))
+                for name in ('venues_by_area', 'venues_by_name', 'artists_by_name', 'shows_by_start',
+                             'shows_by_venue', 'shows_by_artist'))
+            report['total_bytes'] = sum(report[table]['bytes'] for table in RECORDS) + \
+                sum(report['indexes'].values())
+        return report
+
+    # Internals
+
+    def _values(self, table, source):
+        values = dict((field, getattr(source, field)) for field in RECORDS[table].FIELDS)
+        if values.get('genres') is not None:
+            values['genres'] = list(values['genres'])
+        return values
+
+    def _read_rows(self, table, after_id):
+        # from the primary: the table is no longer marked stale, so rows a
+        # lagging replica has not replayed yet would never be read
+        model_table = self.db.metadata.tables[table]
+        rows = self.db.session.execute(
+            model_table.select().where(model_table.c.id > after_id).order_by(model_table.c.id),
+            bind=self.db.engine)
+        for row in rows:
+            self._upsert(table, self._values(table, row))
+            self.caught_up_id[table] = max(self.caught_up_id[table], row.id)
+
+    def _upsert(self, table, values):
+        record = self.records[table].get(values['id'])
+        if record is None:
+            record = RECORDS[table]()
+            if table == 'Show':
+                record.Venue = record.Artist = None
+            self.records[table][values['id']] = record
+        else:
+            self._unindex(table, record)
+        for field, value in values.items():
+            setattr(record, field, value)
+        self._index(table, record)
+        self._changed()
+
+    def _remove(self, table, id):
+        record = self.records[table].pop(id, None)
+        if record is not None:
+            self._unindex(table, record)
+            self._changed()
+
+    def _changed(self):
+        self.version += 1
+        self.changed_at = datetime.now()
+
+    def _index(self, table, record):
+        if table == 'Venue':
+            insort(self.venues_by_area, (text_key(record.state), text_key(record.city), record.id))
+            insort(self.venues_by_name, (text_key(record.name).lower(), record.id))
+        elif table == 'Artist':
+            insort(self.artists_by_name, (text_key(record.name).lower(), record.id))
+        else:
+            record.Venue = self.records['Venue'].get(record.venue_id)
+            record.Artist = self.records['Artist'].get(record.artist_id)
+            # like the /shows join, a show is only listed with both sides
+            if record.Venue is None or record.Artist is None:
+                return
+            key = (record.start_time, record.id)
+            insort(self.shows_by_start, key)
+            insort(self.shows_by_venue.setdefault(record.venue_id, []), key)
+            insort(self.shows_by_artist.setdefault(record.artist_id, []), key)
+
+    def _unindex(self, table, record):
+        if table == 'Venue':
+            self._discard(self.venues_by_area, (text_key(record.state), text_key(record.city), record.id))
+            self._discard(self.venues_by_name, (text_key(record.name).lower(), record.id))
+        elif table == 'Artist':
+            self._discard(self.artists_by_name, (text_key(record.name).lower(), record.id))
+        else:
+            key = (record.start_time, record.id)
+            self._discard(self.shows_by_start, key)
+            for shows_by, id in ((self.shows_by_venue, record.venue_id), (self.shows_by_artist, record.artist_id)):
+                if id in shows_by:
+                    self._discard(shows_by[id], key)
+                    if not shows_by[id]:
+                        del shows_by[id]
+
+    def _discard(self, entries, key):
+        position = bisect_left(entries, key)
+        if position < len(entries) and entries[position] == key:
+            del entries[position]
+
+
+read_model = ReadModel()
@@ -0,0 +1,126 @@
+import random
+import time
+from threading import Lock
+from flask import has_request_context, request, session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import orm, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql.dml import UpdateBase
+
+# seconds the replica's replay is behind; 0 when it has replayed everything
+# it received, or when it is not a standby at all
+REPLICA_LAG = text(
+    'SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END'
+)
+
+
+class ReplicaRouter(object):
+    # Replicas are the SQLALCHEMY_BINDS named replica_<n>. A GET or HEAD
+    # request reads from one of those whose lag, measured at most every
+    # DATABASE_REPLICA_LAG_CHECK_INTERVAL seconds, is within
+    # DATABASE_REPLICA_MAX_LAG; when none is, or the replica cannot be
+    # reached, it reads from the primary. A client that has just written
+    # reads from the primary for max-lag seconds so it sees its own change.
+
+    def __init__(self):
+        self.app = None
+        self.db = None
+        self.binds = []
+        self.lags = {}
+        self.max_lag = 5
+        self.check_interval = 5
+        self.lock = Lock()
+
+    def init_app(self, app, db):
+        self.app = app
+        self.db = db
+        self.binds = sorted(bind for bind in app.config.get('SQLALCHEMY_BINDS') or {} if bind.startswith('replica_'))
+        self.max_lag = app.config.get('DATABASE_REPLICA_MAX_LAG', 5)
+        self.check_interval = app.config.get('DATABASE_REPLICA_LAG_CHECK_INTERVAL', 5)
+        self.lags = {}
+
+    def replica(self):
+        # the engine a read-only request should use, or None for the primary
+        if not self.binds or not has_request_context() or request.method not in ('GET', 'HEAD'):
+            return None
+        if session.get('read_primary_until', 0) > time.time():
+            return None
+        lags = [(bind, self.lag(bind)) for bind in self.binds]
+        current = [bind for bind, lag in lags if lag is not None and lag <= self.max_lag]
+        if not current:
+            return None
+        return self.db.get_engine(self.app, bind=random.choice(current))
+
+    def wrote(self):
+        if self.binds and has_request_context():
+            session['read_primary_until'] = time.time() + self.max_lag
+
+    def lag(self, bind):
+        now = time.time()
+        with self.lock:
+            checked_at, lag = self.lags.get(bind, (None, None))
+            if checked_at is not None and now - checked_at < self.check_interval:
+                return lag
+            # other requests keep using the last value while this one measures
+            self.lags[bind] = (now, lag)
+        lag = self.measure(self.db.get_engine(self.app, bind=bind))
+        with self.lock:
+            self.lags[bind] = (time.time(), lag)
+        return lag
+
+    def measure(self, engine):
+        # None when the replica is down, which keeps reads off it until the
+        # next check
+        if engine.dialect.name != 'postgresql':
+            # nothing to measure, e.g. two local SQLite files
+            return 0
+        try:
+            with engine.connect() as connection:
+                lag = connection.execute(REPLICA_LAG).scalar()
+        except SQLAlchemyError:
+            return None
+        return None if lag is None else float(lag)
+
+
+replica_router = ReplicaRouter()
+
+
+class RoutingSession(SignallingSession):
+    # Flushes and Core INSERT/UPDATE/DELETE statements go to the primary, and
+    # so does everything after them in the same session, so a request reads
+    # its own writes. Other reads use the replica picked for the session.
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or isinstance(clause, UpdateBase):
+            if not self.info.get('primary'):
+                self.info['primary'] = True
+                replica_router.wrote()
+        elif not self.info.get('primary'):
+            if 'replica' not in self.info:
+                self.info['replica'] = replica_router.replica()
+            if self.info['replica'] is not None:
+                return self.info['replica']
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        # Flask-SQLAlchemy 2.5 returns the URL it may have rewritten and
+        # unpacks what this returns; 2.4 returns and expects nothing
+        rv = SQLAlchemy.apply_driver_hacks(self, app, sa_url, options)
+        if rv is not None:
+            sa_url, options = rv
+        options['pool_pre_ping'] = app.config.get('DATABASE_POOL_PRE_PING', True)
+        # SQLite's pools take no size, and only Postgres has statement_timeout
+        if sa_url.drivername.startswith('postgresql'):
+            options['pool_size'] = app.config.get('DATABASE_POOL_SIZE', 5)
+            options['max_overflow'] = app.config.get('DATABASE_MAX_OVERFLOW', 10)
+            timeout = app.config.get('DATABASE_STATEMENT_TIMEOUT', 0)
+            if timeout:
+                options.setdefault('connect_args', {})['options'] = '-c statement_timeout=%d' % timeout
+        return sa_url, options
@@ -0,0 +1,47 @@
+import os
+import time
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from jinja2 import FileSystemBytecodeCache
+
+
+def init_templates(app):
+    # A shared bytecode cache directory lets workers on one host skip
+    # compiling what another worker (or `flask precompile-templates` at
+    # deploy time) already compiled; Jinja keys entries by template source,
+    # so edited templates are recompiled.
+    cache_dir = app.config.get('TEMPLATE_BYTECODE_CACHE_DIR')
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+    if app.config.get('TEMPLATE_PRECOMPILE'):
+        timings = precompile_templates(app)
+        app.logger.info('templates precompiled count=%d ms=%.1f',
+                        len(timings), sum(seconds for name, seconds in timings) * 1000)
+
+
+def precompile_templates(app):
+    # loads every template into the environment's cache at boot instead of
+    # on the first request that renders it; returns (name, seconds) pairs
+    timings = []
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        started = time.perf_counter()
+        app.jinja_env.get_template(name)
+        timings.append((name, time.perf_counter() - started))
+    return timings
+
+
+@click.command('precompile-templates')
+@with_appcontext
+def precompile_templates_command():
+    """Compile every template and report how long each one took.
+
+    With TEMPLATE_BYTECODE_CACHE_DIR set this also fills the on-disk cache,
+    e.g. as a deploy step before workers start."""
+    # templates loaded at boot are already cached; start from a cold cache
+    current_app.jinja_env.cache.clear()
+    timings = precompile_templates(current_app)
+    for name, seconds in sorted(timings, key=lambda timing: -timing[1]):
+        click.echo('%-40s %8.2f ms' % (name, seconds * 1000))
+    click.echo('%d templates in %.2f ms' % (len(timings), sum(seconds for name, seconds in timings) * 1000))
@@ -0,0 +1,114 @@
+import fnmatch
+import unittest
+from flask import Flask
+
+from cache import PageCache, RedisBackend
+
+
+class FakeRedis(object):
+    """The part of the redis-py client RedisBackend uses, kept in a dict."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def incr(self, key):
+        self.data[key] = str(int(self.data.get(key) or 0) + 1).encode('utf-8')
+        return int(self.data[key])
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def scan_iter(self, match):
+        return [key for key in list(self.data) if fnmatch.fnmatchcase(key, match)]
+
+
+class RedisBackendTestCase(unittest.TestCase):
+    """This class represents the Redis page cache backend test case"""
+
+    def setUp(self):
+        self.client = FakeRedis()
+        self.backend = RedisBackend(self.client)
+
+    def test_get_missing_key(self):
+        self.assertIsNone(self.backend.get('missing'))
+
+    def test_set_and_get(self):
+        self.backend.set('page', 'café')
+
+        self.assertEqual(self.client.data['fyyur:page:page'], 'café'.encode('utf-8'))
+        self.assertEqual(self.backend.get('page'), 'café')
+
+    def test_incr_and_counter(self):
+        self.assertEqual(self.backend.counter('generation:shows'), 0)
+        self.assertEqual(self.backend.incr('generation:shows'), 1)
+        self.assertEqual(self.backend.incr('generation:shows'), 2)
+        self.assertEqual(self.backend.counter('generation:shows'), 2)
+
+    def test_clear_only_removes_prefixed_keys(self):
+        self.client.set('other:key', b'kept')
+        self.backend.set('page', 'dropped')
+        self.backend.incr('generation:shows')
+
+        self.backend.clear()
+
+        self.assertEqual(self.client.data, {'other:key': b'kept'})
+        self.assertIsNone(self.backend.get('page'))
+        self.assertEqual(self.backend.counter('generation:shows'), 0)
+
+
+class PageCacheTestCase(unittest.TestCase):
+    """This class represents the tagged page cache test case, on the Redis backend"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SECRET_KEY'] = 'test'
+        self.cache = PageCache()
+        self.cache.init_app(self.app, backend=RedisBackend(FakeRedis()))
+        self.renders = 0
+
+        @self.app.route('/venues/<int:venue_id>')
+        @self.cache.cached('venue:{venue_id}')
+        def show_venue(venue_id):
+            self.renders += 1
+            return 'venue %d render %d' % (venue_id, self.renders)
+
+        self.client = self.app.test_client
+
+    def test_page_served_from_cache(self):
+        first = self.client().get('/venues/1')
+        second = self.client().get('/venues/1')
+
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(self.renders, 1)
+
+    def test_invalidate_drops_tagged_pages_only(self):
+        self.client().get('/venues/1')
+        self.client().get('/venues/1?page=2')
+        self.client().get('/venues/2')
+
+        self.cache.invalidate('venue:1')
+        self.client().get('/venues/1')
+        self.client().get('/venues/1?page=2')
+        res = self.client().get('/venues/2')
+
+        self.assertEqual(self.renders, 5)
+        self.assertEqual(res.data, b'venue 2 render 3')
+
+    def test_fetch_recomputes_after_invalidate(self):
+        with self.app.app_context():
+            self.assertEqual(self.cache.fetch('shows', 'facets', lambda: {'count': 1}), {'count': 1})
+            self.assertEqual(self.cache.fetch('shows', 'facets', lambda: {'count': 2}), {'count': 1})
+            self.cache.invalidate('shows')
+            self.assertEqual(self.cache.fetch('shows', 'facets', lambda: {'count': 2}), {'count': 2})
+
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
+    unittest.main()